@@ -6,7 +6,12 @@ from flask import Flask, render_template, request, jsonify, send_file
 from werkzeug.utils import secure_filename
 import tempfile
 import zipfile
+import uuid
 from datetime import datetime
+from csv_export import EXPORT_FORMATS, write_pricing_csv
+from breakdown import breakdown_page, group_partials
+from movers import MISSING_MARKET_ATTR, find_movers, missing_market_rows
+from pricing_common import current_row_masks, rename_current_columns
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
@@ -15,6 +20,10 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Per-group breakdowns of recent jobs, keyed by output filename
+results_cache = {}
+RESULTS_CACHE_LIMIT = 50
+
 # --- PRICING LOGIC FUNCTIONS ---
 def process_pricing_data(previous_file, current_file):
     """
@@ -88,19 +97,12 @@ def process_pricing_data(previous_file, current_file):
         )
 
         # Rename columns
-        if "My Store Price" in current.columns:
-            current = current.rename(columns={"My Store Price": "Old My Store Price"})
-        else:
-            current["Old My Store Price"] = float('nan')
-
-        if "TCG Marketplace Price" in current.columns:
-            current = current.rename(columns={"TCG Marketplace Price": "Old Marketplace Price"})
-        else:
-            current["Old Marketplace Price"] = float('nan')
+        current = rename_current_columns(current)
 
-        # Filter rows
-        current = current[current["Condition"] != "Unopened"]
-        current = current[current["TCG Market Price"].notna()]
+        # Filter rows, keeping a tally of the ones dropped for a missing market price
+        missing_market = missing_market_rows(current)
+        not_unopened, has_market = current_row_masks(current)
+        current = current[not_unopened & has_market]
 
         # Ensure TCGplayer Id is numeric
         current["TCGplayer Id"] = pd.to_numeric(current["TCGplayer Id"], errors='coerce').astype('Int64')
@@ -171,6 +173,7 @@ def process_pricing_data(previous_file, current_file):
         merged["Old My Store Price"] = merged["Old My Store Price"].fillna(0.0)
         merged["Diff"] = merged["My Store Price"] - merged["Old My Store Price"]
 
+        merged.attrs[MISSING_MARKET_ATTR] = missing_market
         return merged, None
         
     except Exception as e:
@@ -196,15 +199,20 @@ def process_files():
         if previous_file.filename == '' or current_file.filename == '':
             return jsonify({'error': 'Please select both files'}), 400
         
+        # Optionally limit the export to TCGplayer's bulk upload columns
+        export_format = request.form.get('export_format', 'full')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f'Unknown export format: {export_format}'}), 400
+
         # Process the files
         merged_df, error = process_pricing_data(previous_file, current_file)
         
         if error:
             return jsonify({'error': f'Processing error: {error}'}), 500
         
-        # Convert to CSV string
-        output = io.StringIO()
-        merged_df.to_csv(output, index=False)
+        # Convert to CSV bytes
+        output = io.BytesIO()
+        write_pricing_csv(merged_df, output, columns=EXPORT_FORMATS[export_format])
         csv_content = output.getvalue()
         
         # Create summary statistics
@@ -217,22 +225,43 @@ def process_files():
                 'increased': len(merged_df[merged_df['Diff'] > 0]),
                 'decreased': len(merged_df[merged_df['Diff'] < 0]),
                 'unchanged': len(merged_df[merged_df['Diff'] == 0])
-            }
+            },
+            'movers': find_movers(merged_df)
         }
         
         # Encode CSV content for download
-        csv_b64 = base64.b64encode(csv_content.encode()).decode()
+        csv_b64 = base64.b64encode(csv_content).decode()
         
+        # Keep the per-group breakdown for the paginated breakdown API
+        # The random suffix keeps uploads in the same second from sharing a name
+        filename = f'updated_pricing_{datetime.now().strftime("%Y%m%d_%H%M%S")}_{uuid.uuid4().hex[:8]}.csv'
+        results_cache[filename] = group_partials(merged_df)
+        while len(results_cache) > RESULTS_CACHE_LIMIT:
+            results_cache.pop(next(iter(results_cache)))
+
         return jsonify({
             'success': True,
             'summary': summary,
             'csv_data': csv_b64,
-            'filename': f'updated_pricing_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+            'filename': filename,
+            'breakdown_url': f'/breakdown/{filename}'
         })
         
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+@app.route('/breakdown/<filename>')
+def get_breakdown(filename):
+    """Paginated per-group breakdown of a processed file"""
+    if filename not in results_cache:
+        return jsonify({'error': 'No breakdown for this file'}), 404
+
+    payload, error = breakdown_page(results_cache[filename], request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    payload['filename'] = filename
+    return jsonify(payload)
+
 @app.route('/download/<filename>')
 def download_file(filename):
     """Download the processed CSV file"""
@@ -10,10 +10,25 @@ import csv
 from datetime import datetime
 import threading
 import queue
+import uuid
+import shutil
+from arrow_pricing import process_pricing_data_arrow
+from csv_export import EXPORT_FORMATS, write_pricing_csv
+from breakdown import breakdown_page, group_partials, partial_from_json
+from broker import SQLiteBroker
+from pricing import build_summary, process_pricing_data_large, process_pricing_data_streaming
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# Memory budget shared by concurrent jobs and how long a job may queue for it
+app.config['MEMORY_BUDGET_MB'] = int(os.environ.get('MEMORY_BUDGET_MB', 2048))
+app.config['ADMISSION_WAIT_SECONDS'] = float(os.environ.get('ADMISSION_WAIT_SECONDS', 30))
+# In-memory engine: 'pandas' (row-wise apply) or 'arrow' (Arrow-backed, vectorized)
+app.config['PRICING_ENGINE'] = os.environ.get('PRICING_ENGINE', 'pandas')
+# Shared broker directory for multi-node jobs (see worker.py); unset prices in this process
+app.config['BROKER_DIR'] = os.environ.get('BROKER_DIR', '')
+app.config['SHARD_ROWS'] = int(os.environ.get('SHARD_ROWS', 50000))
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -21,197 +36,179 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 # Global processing queue
 processing_queue = queue.Queue()
 results_cache = {}
+RESULTS_CACHE_LIMIT = 50
 
-def process_csv_chunked(file_path, file_type):
+# --- MEMORY ADMISSION CONTROL ---
+class MemoryBudget:
     """
-    Process large CSV files in chunks to handle 300MB+ files
+    Tracks the memory reserved by running jobs so that concurrent uploads
+    cannot push the process past a fixed budget
     """
-    try:
-        # Read CSV in chunks
-        chunk_size = 10000  # Process 10k rows at a time
-        chunks = []
-        
-        print(f"Processing {file_type} file: {file_path}")
-        
-        for chunk in pd.read_csv(file_path, chunksize=chunk_size, encoding='utf-8-sig'):
-            chunks.append(chunk)
-            print(f"Processed chunk of {len(chunk)} rows")
-        
-        # Combine all chunks
-        df = pd.concat(chunks, ignore_index=True)
-        print(f"Total rows in {file_type}: {len(df)}")
-        
-        return df, None
-        
-    except Exception as e:
-        return None, str(e)
 
-def process_pricing_data_large(previous_file_path, current_file_path):
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.reserved_bytes = 0
+        self.peak_reserved_bytes = 0
+        self.active_jobs = 0
+        self.waiting_jobs = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes, timeout=None):
+        """
+        Reserve nbytes, waiting up to timeout seconds for other jobs to finish.
+        Returns False if the reservation could not be made.
+        """
+        with self._condition:
+            if nbytes > self.limit_bytes:
+                return False
+            self.waiting_jobs += 1
+            try:
+                admitted = self._condition.wait_for(
+                    lambda: self.reserved_bytes + nbytes <= self.limit_bytes,
+                    timeout
+                )
+            finally:
+                self.waiting_jobs -= 1
+            if admitted:
+                self._reserve(nbytes)
+            return admitted
+
+    def release(self, nbytes):
+        """Return a reservation and wake up queued jobs"""
+        with self._condition:
+            self.reserved_bytes = max(0, self.reserved_bytes - nbytes)
+            self.active_jobs = max(0, self.active_jobs - 1)
+            self._condition.notify_all()
+
+    def _reserve(self, nbytes):
+        self.reserved_bytes += nbytes
+        self.active_jobs += 1
+        self.peak_reserved_bytes = max(self.peak_reserved_bytes, self.reserved_bytes)
+
+    def stats(self):
+        """Snapshot of the budget for monitoring"""
+        with self._condition:
+            return {
+                'limit_mb': round(self.limit_bytes / (1024 * 1024), 2),
+                'reserved_mb': round(self.reserved_bytes / (1024 * 1024), 2),
+                'peak_reserved_mb': round(self.peak_reserved_bytes / (1024 * 1024), 2),
+                'active_jobs': self.active_jobs,
+                'waiting_jobs': self.waiting_jobs
+            }
+
+# Rough cost model for the in-memory path: previous + current + merged copy
+# are all resident at once, and parsed cells take several times their CSV size
+MEMORY_BYTES_PER_FILE_BYTE = 3
+MEMORY_BYTES_PER_ROW = 200
+STREAMING_CHUNK_SIZE = 10000
+
+def count_csv_rows(file_path, block_size=1024 * 1024):
+    """Count data rows in a CSV by scanning it in binary blocks"""
+    lines = 0
+    last_block = b''
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            lines += block.count(b'\n')
+            last_block = block
+    if last_block and not last_block.endswith(b'\n'):
+        lines += 1
+    return max(0, lines - 1)
+
+def estimate_job_memory(previous_file_path, current_file_path):
     """
-    Process large pricing data files with memory optimization
+    Estimate the peak memory (in bytes) of the in-memory and streaming paths
+    from the input file sizes and row counts
     """
-    try:
-        print("Starting large file processing...")
-        
-        # Process previous file
-        previous, error = process_csv_chunked(previous_file_path, "previous")
-        if error:
-            return None, f"Error processing previous file: {error}"
-        
-        # Process current file
-        current, error = process_csv_chunked(current_file_path, "current")
-        if error:
-            return None, f"Error processing current file: {error}"
-        
-        print(f"Previous file: {len(previous)} rows")
-        print(f"Current file: {len(current)} rows")
-        
-        # Define required columns for previous.csv
-        required_previous_columns = {
-            "TCGplayer Id": 'Int64',
-            "Product Line": 'string',
-            "Set Name": 'string',
-            "Product Name": 'string',
-            "Title": 'string',
-            "Number": 'string',
-            "Rarity": 'string',
-            "Condition": 'string',
-            "TCG Market Price": 'float64',
-            "TCG Direct Low": 'float64',
-            "TCG Low Price With Shipping": 'float64',
-            "TCG Low Price": 'float64',
-            "Total Quantity": 'Int64',
-            "Add to Quantity": 'Int64',
-            "Old Marketplace Price": 'float64',
-            "My Store Reserve Quantity": 'Int64',
-            "Old My Store Price": 'float64',
-            "Photo URL": 'string',
-            "Old Qty": 'Int64',
-            "Base Price": 'float64',
-            "TCG Marketplace Price": 'float64',
-            "My Store Price": 'float64',
-            "Old Multiplier": 'float64',
-            "Multiplier": 'float64',
-            "Diff": 'float64'
-        }
+    previous_bytes = os.path.getsize(previous_file_path)
+    current_bytes = os.path.getsize(current_file_path)
+    previous_rows = count_csv_rows(previous_file_path)
+    current_rows = count_csv_rows(current_file_path)
 
-        # Add missing columns with default values
-        for col, dtype in required_previous_columns.items():
-            if col not in previous.columns:
-                if dtype == 'float64':
-                    previous[col] = float('nan')
-                elif dtype == 'Int64':
-                    previous[col] = pd.NA
-                else:
-                    previous[col] = ''
-
-        # Convert column types
-        for col, dtype in required_previous_columns.items():
-            try:
-                if dtype == 'Int64':
-                    previous[col] = pd.to_numeric(previous[col], errors='coerce').astype('Int64')
-                elif dtype == 'float64':
-                    previous[col] = pd.to_numeric(previous[col], errors='coerce')
-                elif dtype == 'string':
-                    previous[col] = previous[col].astype(str)
-            except Exception:
-                previous[col] = float('nan')
-
-        # Rename columns in current file
-        if "My Store Price" in current.columns:
-            current = current.rename(columns={"My Store Price": "Old My Store Price"})
-        else:
-            current["Old My Store Price"] = float('nan')
+    in_memory = (
+        MEMORY_BYTES_PER_FILE_BYTE * (previous_bytes + 2 * current_bytes)
+        + MEMORY_BYTES_PER_ROW * (previous_rows + 2 * current_rows)
+    )
 
-        if "TCG Marketplace Price" in current.columns:
-            current = current.rename(columns={"TCG Marketplace Price": "Old Marketplace Price"})
-        else:
-            current["Old Marketplace Price"] = float('nan')
-
-        # Filter rows
-        current = current[current["Condition"] != "Unopened"]
-        current = current[current["TCG Market Price"].notna()]
-
-        # Ensure TCGplayer Id is numeric
-        current["TCGplayer Id"] = pd.to_numeric(current["TCGplayer Id"], errors='coerce').astype('Int64')
-
-        print("Merging data...")
-        # Merge data
-        merged = pd.merge(
-            current,
-            previous[["TCGplayer Id", "Old Multiplier"]],
-            on="TCGplayer Id",
-            how="left"
-        )
-
-        # Fill missing Old Multiplier with default value
-        merged["Old Multiplier"] = merged["Old Multiplier"].fillna(1.2)
-
-        print("Calculating base prices...")
-        # Calculate Base Price
-        def calculate_base_price(row):
-            market = row["TCG Market Price"]
-            low = row["TCG Low Price"]
-            if pd.notna(market) and pd.notna(low):
-                return round(min(market, low), 2)
-            elif pd.notna(low):
-                return round(low, 2)
-            elif pd.notna(market):
-                return round(market, 2)
-            else:
-                return 50000.00
-
-        merged["Base Price"] = merged.apply(calculate_base_price, axis=1)
-
-        print("Calculating multipliers...")
-        # Calculate Multiplier
-        def calculate_multiplier(row):
-            old_qty = row.get("Old Qty", 0)
-            new_qty = row.get("Total Quantity", 0)
-            old_mult = row.get("Old Multiplier", 1.2)
-
-            if old_qty == 0:
-                return 1.2
-            elif old_qty > 0 and new_qty == 0:
-                return 1.2
-            elif old_qty < new_qty:
-                return round(old_mult + 0.01, 2)
-            elif old_mult - 0.05 > 1:
-                return round(old_mult - 0.05, 2)
-            else:
-                return round(old_mult - 0.01, 2)
-
-        merged["Multiplier"] = merged.apply(calculate_multiplier, axis=1)
-
-        print("Calculating store prices...")
-        # Calculate My Store Price
-        def calculate_store_price(row):
-            market_price = row["TCG Market Price"]
-            base = row["Base Price"]
-            mult = row["Multiplier"]
-            qty = row["Total Quantity"]
-
-            raw_price = round(market_price if pd.notna(market_price) else base * mult, 2)
-            bump = 0.25
-            if qty >= 40:
-                bump = 0.05
-            elif qty >= 20:
-                bump = 0.15
-            return raw_price + max(0, bump - raw_price)
-
-        merged["My Store Price"] = merged.apply(calculate_store_price, axis=1)
-
-        print("Calculating differences...")
-        # Calculate Diff
-        merged["Old My Store Price"] = merged["Old My Store Price"].fillna(0.0)
-        merged["Diff"] = merged["My Store Price"] - merged["Old My Store Price"]
-
-        print("Processing complete!")
-        return merged, None
-        
+    # Streaming keeps only the previous lookup table and one chunk resident
+    chunk_fraction = min(1.0, STREAMING_CHUNK_SIZE / current_rows) if current_rows else 1.0
+    streaming = (
+        MEMORY_BYTES_PER_ROW * previous_rows
+        + MEMORY_BYTES_PER_FILE_BYTE * 2 * current_bytes * chunk_fraction
+        + MEMORY_BYTES_PER_ROW * 2 * min(current_rows, STREAMING_CHUNK_SIZE)
+    )
+
+    return {
+        'previous_rows': previous_rows,
+        'current_rows': current_rows,
+        'in_memory_bytes': int(in_memory),
+        'streaming_bytes': int(streaming)
+    }
+
+memory_budget = MemoryBudget(app.config['MEMORY_BUDGET_MB'] * 1024 * 1024)
+
+def admit_job(estimate):
+    """
+    Decide how to run a job: 'in_memory' when its full estimate fits the budget,
+    otherwise 'streaming' once its smaller estimate fits. Each attempt queues
+    for up to ADMISSION_WAIT_SECONDS.
+    Returns the mode and the number of bytes reserved, which must be released,
+    or (None, 0) if the job could not be admitted at all.
+    """
+    wait = app.config['ADMISSION_WAIT_SECONDS']
+    if memory_budget.acquire(estimate['in_memory_bytes'], timeout=wait):
+        return 'in_memory', estimate['in_memory_bytes']
+
+    if memory_budget.acquire(estimate['streaming_bytes'], timeout=wait):
+        return 'streaming', estimate['streaming_bytes']
+
+    return None, 0
+
+# --- DISTRIBUTED JOBS ---
+broker = SQLiteBroker(app.config['BROKER_DIR']) if app.config['BROKER_DIR'] else None
+
+def submit_pricing_job(broker, previous_file_path, current_file_path, columns=None, shard_rows=50000):
+    """
+    Move the uploads into the broker directory and queue the job for worker.py.
+    A worker splits current.csv into shards of shard_rows rows, the shards are
+    priced in parallel and a last task collects them into the job's output.
+    Returns the job id and any error.
+    """
+    job_id = broker.new_job_id()
+    job_dir = broker.job_dir(job_id)
+    try:
+        previous_path = os.path.join(job_dir, 'previous.csv')
+        current_path = os.path.join(job_dir, 'current.csv')
+        shutil.move(previous_file_path, broker.path(previous_path))
+        shutil.move(current_file_path, broker.path(current_path))
+
+        output_filename = f"updated_pricing_{job_id}.csv"
+        split_payload = {
+            'previous_path': previous_path,
+            'current_path': current_path,
+            'shard_rows': shard_rows,
+            'columns': columns
+        }
+        collect_payload = {
+            'filename': output_filename,
+            'output_path': broker.result_path(output_filename),
+            'breakdown_path': broker.result_path(job_breakdown_filename(output_filename))
+        }
+        broker.submit_job(job_id, split_payload, collect_payload)
     except Exception as e:
+        # The job was never queued, so nothing else will remove its files
+        shutil.rmtree(broker.path(job_dir), ignore_errors=True)
         return None, str(e)
 
+    print(f"Submitted job {job_id}")
+    return job_id, None
+
+def job_breakdown_filename(output_filename):
+    """Name of the breakdown partial stored next to a distributed job's output"""
+    return os.path.splitext(output_filename)[0] + '.breakdown.json'
+
 @app.route('/')
 def index():
     """Main page with file upload interface"""
@@ -232,6 +229,12 @@ def process_large_files():
         if previous_file.filename == '' or current_file.filename == '':
             return jsonify({'error': 'Please select both files'}), 400
         
+        # Optionally limit the export to TCGplayer's bulk upload columns
+        export_format = request.form.get('export_format', 'full')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f'Unknown export format: {export_format}'}), 400
+        export_columns = EXPORT_FORMATS[export_format]
+
         # Save files to temporary location
         with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as temp_previous:
             previous_file.save(temp_previous.name)
@@ -241,53 +244,162 @@ def process_large_files():
             current_file.save(temp_current.name)
             current_path = temp_current.name
         
-        # Process the files
-        merged_df, error = process_pricing_data_large(previous_path, current_path)
-        
-        # Clean up temporary files
+        # With a broker, workers do the pricing and the client polls the job
+        if broker is not None:
+            try:
+                job_id, error = submit_pricing_job(
+                    broker, previous_path, current_path,
+                    columns=export_columns, shard_rows=app.config['SHARD_ROWS']
+                )
+            finally:
+                for path in (previous_path, current_path):
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+            if error:
+                return jsonify({'error': f'Could not queue job: {error}'}), 500
+
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'mode': 'distributed',
+                'status_url': f'/jobs/{job_id}'
+            }), 202
+
+        # The random suffix keeps concurrent jobs from writing to the same file
+        output_filename = f"updated_pricing_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.csv"
+        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+
+        # Reserve memory for the job, falling back to streaming if it doesn't fit
+        estimate = estimate_job_memory(previous_path, current_path)
+        mode, reserved_bytes = admit_job(estimate)
+        if mode is None:
+            for path in (previous_path, current_path):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            return jsonify({'error': 'Server is busy, please try again in a few minutes'}), 503
+        print(f"Running job in {mode} mode ({reserved_bytes / (1024 * 1024):.1f} MB reserved)")
+
         try:
-            os.unlink(previous_path)
-            os.unlink(current_path)
-        except:
-            pass
+            if mode == 'in_memory' and app.config['PRICING_ENGINE'] == 'arrow':
+                merged_df, error = process_pricing_data_arrow(previous_path, current_path)
+                if not error:
+                    summary = build_summary(merged_df)
+                    breakdown = group_partials(merged_df)
+                    write_pricing_csv(merged_df, output_path, columns=export_columns)
+                del merged_df
+            elif mode == 'in_memory':
+                merged_df, error = process_pricing_data_large(previous_path, current_path)
+                if not error:
+                    summary = build_summary(merged_df)
+                    breakdown = group_partials(merged_df)
+                    # Save to temporary file for download
+                    write_pricing_csv(merged_df, output_path, columns=export_columns)
+                del merged_df
+            else:
+                result, error = process_pricing_data_streaming(
+                    previous_path, current_path, output_path,
+                    chunk_size=STREAMING_CHUNK_SIZE, columns=export_columns
+                )
+                if not error:
+                    summary, breakdown = result['summary'], result['breakdown']
+        finally:
+            memory_budget.release(reserved_bytes)
+
+            # Clean up temporary files
+            try:
+                os.unlink(previous_path)
+                os.unlink(current_path)
+            except:
+                pass
         
         if error:
             return jsonify({'error': f'Processing error: {error}'}), 500
         
-        # Create summary statistics
-        summary = {
-            'total_items': len(merged_df),
-            'avg_market_price': round(merged_df['TCG Market Price'].mean(), 2),
-            'avg_store_price': round(merged_df['My Store Price'].mean(), 2),
-            'total_value': round(merged_df['My Store Price'].sum(), 2),
-            'price_changes': {
-                'increased': len(merged_df[merged_df['Diff'] > 0]),
-                'decreased': len(merged_df[merged_df['Diff'] < 0]),
-                'unchanged': len(merged_df[merged_df['Diff'] == 0])
-            }
-        }
-        
-        # Save to temporary file for download
-        output_filename = f"updated_pricing_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-        merged_df.to_csv(output_path, index=False)
-        
+        cache_result(output_filename, summary, breakdown)
+
         return jsonify({
             'success': True,
             'summary': summary,
+            'mode': mode,
+            'engine': app.config['PRICING_ENGINE'] if mode == 'in_memory' else 'pandas',
+            'estimated_memory_mb': round(reserved_bytes / (1024 * 1024), 2),
             'filename': output_filename,
-            'file_size_mb': round(os.path.getsize(output_path) / (1024 * 1024), 2)
+            'file_size_mb': round(os.path.getsize(output_path) / (1024 * 1024), 2),
+            'breakdown_url': f'/breakdown/{output_filename}'
         })
         
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+def cache_result(filename, summary, breakdown):
+    """Keep the summary and breakdown of recent jobs for the breakdown API"""
+    results_cache[filename] = {'summary': summary, 'breakdown': breakdown}
+    while len(results_cache) > RESULTS_CACHE_LIMIT:
+        results_cache.pop(next(iter(results_cache)))
+
+@app.route('/breakdown/<filename>')
+def get_breakdown(filename):
+    """Paginated per-group breakdown of a processed file"""
+    result = results_cache.get(filename)
+    if result is None and broker is not None:
+        # Distributed jobs leave their breakdown in the broker's results
+        breakdown_path = broker.path(broker.result_path(job_breakdown_filename(filename)))
+        if os.path.isfile(breakdown_path):
+            with open(breakdown_path) as f:
+                cache_result(filename, None, partial_from_json(json.load(f)))
+            result = results_cache[filename]
+    if result is None or result['breakdown'] is None:
+        return jsonify({'error': 'No breakdown for this file'}), 404
+
+    payload, error = breakdown_page(result['breakdown'], request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    payload['filename'] = filename
+    return jsonify(payload)
+
+@app.route('/jobs/<job_id>')
+def get_job_status(job_id):
+    """Progress of a distributed job, and its result once a worker has collected it"""
+    if broker is None:
+        return jsonify({'error': 'Distributed processing is not enabled'}), 404
+
+    status = broker.job_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+
+    response = {
+        'job_id': job_id,
+        'status': status['status'],
+        'shards': status['shards'],
+        'total_shards': status['total_shards']
+    }
+    if status['status'] == 'failed':
+        response['error'] = f"Processing error: {status['error']}"
+    elif status['status'] == 'done':
+        response.update(status['result'])
+        response['success'] = True
+        response['mode'] = 'distributed'
+        response['breakdown_url'] = f"/breakdown/{status['result']['filename']}"
+    return jsonify(response)
+
+@app.route('/memory_status')
+def memory_status():
+    """Current and peak reserved memory of the admission controller"""
+    return jsonify(memory_budget.stats())
+
 @app.route('/download/<filename>')
 def download_file(filename):
     """Download the processed CSV file"""
     try:
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(file_path):
+        if not os.path.exists(file_path) and broker is not None:
+            # Outputs of distributed jobs stay in the broker's results
+            file_path = broker.path(broker.result_path(filename))
+        if os.path.isfile(file_path):
             return send_file(file_path, as_attachment=True, download_name=filename)
         else:
             return jsonify({'error': 'File not found'}), 404
@@ -0,0 +1,161 @@
+"""
+Arrow-backed pricing path for the large file app.
+
+CSV files are parsed straight into pyarrow tables and wrapped as pandas
+ArrowDtype columns without copying. Passthrough columns (Photo URL, Product
+Name, ...) stay in Arrow buffers from parse to export; only the numeric pricing
+columns are converted to NumPy arrays for the calculation.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow.csv as pa_csv
+
+from movers import MISSING_MARKET_ATTR, missing_market_rows
+from pricing_common import (
+    DEFAULT_MULTIPLIER,
+    FALLBACK_BASE_PRICE,
+    current_row_masks,
+    rename_current_columns,
+    round2,
+    to_float_array
+)
+
+# pandas' default na_values; pyarrow's own list lacks e.g. "None" and "<NA>"
+PANDAS_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None",
+    "n/a", "nan", "null"
+]
+
+def read_csv_arrow(file_path, columns=None):
+    """
+    Parse a CSV into a DataFrame of ArrowDtype columns.
+    When columns is given, only those are read and missing ones come back as nulls.
+    Empty and NA-like text cells are nulls, as they are NaN in pandas' read_csv.
+    """
+    convert_options = pa_csv.ConvertOptions(
+        null_values=PANDAS_NA_VALUES,
+        strings_can_be_null=True
+    )
+    if columns is not None:
+        convert_options = pa_csv.ConvertOptions(
+            null_values=PANDAS_NA_VALUES,
+            strings_can_be_null=True,
+            include_columns=columns,
+            include_missing_columns=True
+        )
+    table = pa_csv.read_csv(file_path, convert_options=convert_options)
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+def to_id_series(series):
+    """Same coercion as the pandas path: numeric, then nullable Int64"""
+    try:
+        return pd.to_numeric(series, errors='coerce').astype('Int64')
+    except Exception:
+        return pd.Series(float('nan'), index=series.index)
+
+def calculate_prices(market, low, qty, old_qty, old_mult):
+    """
+    Vectorized equivalent of calculate_base_price, calculate_multiplier and
+    calculate_store_price. All inputs are float64 arrays with NaN for missing.
+    """
+    market_ok = ~np.isnan(market)
+    low_ok = ~np.isnan(low)
+
+    # Base Price
+    base = np.where(market_ok & low_ok, np.minimum(market, low), np.where(low_ok, low, market))
+    base = np.where(market_ok | low_ok, round2(base), FALLBACK_BASE_PRICE)
+
+    # Multiplier
+    with np.errstate(invalid='ignore'):
+        multiplier = np.select(
+            [
+                old_qty == 0,
+                (old_qty > 0) & (qty == 0),
+                old_qty < qty,
+                old_mult - 0.05 > 1
+            ],
+            [
+                DEFAULT_MULTIPLIER,
+                DEFAULT_MULTIPLIER,
+                round2(old_mult + 0.01),
+                round2(old_mult - 0.05)
+            ],
+            default=round2(old_mult - 0.01)
+        )
+
+        # My Store Price
+        raw_price = round2(np.where(market_ok, market, base * multiplier))
+        bump = np.select([qty >= 40, qty >= 20], [0.05, 0.15], default=0.25)
+        shortfall = bump - raw_price
+        store_price = raw_price + np.where(shortfall > 0, shortfall, 0)
+
+    return base, multiplier, store_price
+
+def process_pricing_data_arrow(previous_file_path, current_file_path):
+    """
+    Arrow-backed equivalent of process_pricing_data_large.
+    Returns the priced DataFrame and any error.
+    """
+    try:
+        print("Starting Arrow processing...")
+
+        # Only the lookup columns of previous.csv are needed
+        previous = read_csv_arrow(previous_file_path, columns=["TCGplayer Id", "Old Multiplier"])
+        previous_ids = to_id_series(previous["TCGplayer Id"])
+        previous_mult = pd.Series(to_float_array(previous["Old Multiplier"]))
+
+        current = read_csv_arrow(current_file_path)
+        print(f"Previous file: {len(previous)} rows")
+        print(f"Current file: {len(current)} rows")
+
+        # Rename and filter exactly as the pandas path does
+        current = rename_current_columns(current)
+        missing_market = missing_market_rows(current)
+        not_unopened, has_market = current_row_masks(current)
+        kept_rows = np.flatnonzero(not_unopened & has_market)
+
+        print("Merging data...")
+        # Join on the ids alone, then gather all current columns in one Arrow take
+        current_ids = to_id_series(current["TCGplayer Id"].take(kept_rows)).reset_index(drop=True)
+        joined = pd.merge(
+            pd.DataFrame({"TCGplayer Id": current_ids, "_row": np.arange(len(kept_rows))}),
+            pd.DataFrame({"TCGplayer Id": previous_ids, "Old Multiplier": previous_mult}),
+            on="TCGplayer Id",
+            how="left"
+        )
+        join_rows = joined["_row"].to_numpy()
+
+        merged = current.take(kept_rows[join_rows]).reset_index(drop=True)
+        merged["TCGplayer Id"] = current_ids.take(join_rows).reset_index(drop=True)
+        merged["Old Multiplier"] = joined["Old Multiplier"].fillna(DEFAULT_MULTIPLIER).to_numpy(dtype='float64')
+
+        print("Calculating prices...")
+        market = to_float_array(merged["TCG Market Price"])
+        low = to_float_array(merged["TCG Low Price"])
+        qty = to_float_array(merged["Total Quantity"])
+        if "Old Qty" in merged.columns:
+            old_qty = to_float_array(merged["Old Qty"])
+        else:
+            old_qty = np.zeros(len(merged))
+
+        base, multiplier, store_price = calculate_prices(
+            market, low, qty, old_qty, merged["Old Multiplier"].to_numpy()
+        )
+        merged["Base Price"] = base
+        merged["Multiplier"] = multiplier
+        merged["My Store Price"] = store_price
+
+        # Calculate Diff
+        old_store_price = to_float_array(merged["Old My Store Price"])
+        old_store_price = np.where(np.isnan(old_store_price), 0.0, old_store_price)
+        merged["Old My Store Price"] = old_store_price
+        merged["Diff"] = store_price - old_store_price
+        merged.attrs[MISSING_MARKET_ATTR] = missing_market
+
+        print("Processing complete!")
+        return merged, None
+
+    except Exception as e:
+        return None, str(e)
@@ -0,0 +1,246 @@
+"""
+Per-group breakdown of a pricing run over Product Line, Set Name and Rarity.
+
+group_partials aggregates a priced frame (or one streaming chunk) in a single
+vectorized pass over combined categorical codes. Partials from several chunks
+are merged with combine_partials, and breakdown_page turns the finest-level
+partial into one page of a drill-down table.
+"""
+
+import numpy as np
+import pandas as pd
+
+from pricing_common import to_float_array
+
+GROUP_COLUMNS = ["Product Line", "Set Name", "Rarity"]
+
+# Drill-down levels and how many of GROUP_COLUMNS each one groups by
+LEVELS = {
+    'product_line': 1,
+    'set': 2,
+    'rarity': 3
+}
+
+# Query parameters that narrow the breakdown to one parent group
+FILTER_PARAMS = {
+    'product_line': "Product Line",
+    'set_name': "Set Name",
+    'rarity': "Rarity"
+}
+
+STAT_COLUMNS = [
+    'count',
+    'market_sum',
+    'market_count',
+    'value',
+    'value_count',
+    'diff_sum',
+    'diff_count',
+    'increased',
+    'decreased',
+    'unchanged'
+]
+
+SORT_KEYS = ['value', 'count', 'avg_change', 'increased', 'decreased']
+
+MOVER_COLUMNS = ["TCGplayer Id", "Product Name", "Condition", "Old My Store Price", "My Store Price", "Diff"]
+MONEY_MOVER_COLUMNS = {"Old My Store Price", "My Store Price", "Diff"}
+TOP_MOVERS_PER_GROUP = 5
+BLANK_GROUP = "(blank)"
+MAX_PER_PAGE = 500
+
+def group_codes(merged_df):
+    """
+    Factorize the group columns and combine them into one code per row.
+    Returns the combined codes and the label of every code for each column.
+    """
+    codes = []
+    labels = []
+    for col in GROUP_COLUMNS:
+        if col in merged_df.columns:
+            col_codes, uniques = pd.factorize(merged_df[col])
+            col_labels = [str(value) for value in uniques] + [BLANK_GROUP]
+            col_codes = np.where(col_codes < 0, len(uniques), col_codes)
+        else:
+            col_codes = np.zeros(len(merged_df), dtype=np.int64)
+            col_labels = [BLANK_GROUP]
+        codes.append(col_codes)
+        labels.append(np.asarray(col_labels, dtype=object))
+
+    dims = [len(col_labels) for col_labels in labels]
+    combined = np.ravel_multi_index(codes, dims) if len(merged_df) else np.zeros(0, dtype=np.int64)
+    return combined, codes, labels
+
+def top_movers(movers, by, top_n=TOP_MOVERS_PER_GROUP):
+    """Keep the top_n rows with the largest absolute Diff in each group"""
+    movers = movers.sort_values('Abs Diff', ascending=False, kind='stable')
+    return movers.groupby(by, sort=False).head(top_n)
+
+def group_partials(merged_df, top_n=TOP_MOVERS_PER_GROUP):
+    """
+    Aggregate a priced frame by all GROUP_COLUMNS.
+    Returns {'groups': per-group sums, 'movers': top_n movers per group}.
+    """
+    combined, codes, labels = group_codes(merged_df)
+    groups, first, inverse = np.unique(combined, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    size = len(groups)
+
+    def total(weights):
+        return np.bincount(inverse, weights=weights, minlength=size)
+
+    market = to_float_array(merged_df["TCG Market Price"])
+    value = to_float_array(merged_df["My Store Price"])
+    diff = to_float_array(merged_df["Diff"])
+
+    stats = pd.DataFrame({
+        col: labels[i][codes[i][first]]
+        for i, col in enumerate(GROUP_COLUMNS)
+    })
+    stats['count'] = np.bincount(inverse, minlength=size)
+    stats['market_sum'] = total(np.where(np.isnan(market), 0.0, market))
+    stats['market_count'] = total(~np.isnan(market))
+    stats['value'] = total(np.where(np.isnan(value), 0.0, value))
+    stats['value_count'] = total(~np.isnan(value))
+    stats['diff_sum'] = total(np.where(np.isnan(diff), 0.0, diff))
+    stats['diff_count'] = total(~np.isnan(diff))
+    stats['increased'] = total(diff > 0)
+    stats['decreased'] = total(diff < 0)
+    stats['unchanged'] = total(diff == 0)
+
+    # Rank rows by |Diff| within their group and keep the first top_n
+    abs_diff = np.abs(diff)
+    order = np.lexsort((-np.where(np.isnan(abs_diff), -1.0, abs_diff), inverse))
+    sorted_groups = inverse[order]
+    starts = np.searchsorted(sorted_groups, np.arange(size))
+    rank = np.arange(len(order)) - starts[sorted_groups]
+    picked = order[rank < top_n]
+    picked = picked[~np.isnan(abs_diff[picked])]
+
+    movers = merged_df.iloc[picked][[col for col in MOVER_COLUMNS if col in merged_df.columns]]
+    movers = movers.reset_index(drop=True)
+    for i, col in enumerate(GROUP_COLUMNS):
+        movers[col] = labels[i][codes[i][picked]]
+    movers['Abs Diff'] = abs_diff[picked]
+
+    return {'groups': stats, 'movers': movers}
+
+def combine_partials(left, right, top_n=TOP_MOVERS_PER_GROUP):
+    """Merge two partials (e.g. the running total and a new streaming chunk)"""
+    groups = pd.concat([left['groups'], right['groups']], ignore_index=True)
+    groups = groups.groupby(GROUP_COLUMNS, sort=False, as_index=False)[STAT_COLUMNS].sum()
+    movers = pd.concat([left['movers'], right['movers']], ignore_index=True)
+    return {'groups': groups, 'movers': top_movers(movers, GROUP_COLUMNS, top_n)}
+
+def json_value(value, digits=None):
+    """Plain JSON value: NA becomes None, floats are optionally rounded"""
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, (np.integer, int)):
+        return int(value)
+    if isinstance(value, (np.floating, float)):
+        return round(float(value), digits) if digits is not None else float(value)
+    return value
+
+def frame_to_json(frame):
+    """Column-wise JSON form of a partial's frame that keeps its dtypes"""
+    return {
+        'dtypes': {col: str(dtype) for col, dtype in frame.dtypes.items()},
+        'columns': {col: [json_value(value) for value in frame[col].tolist()] for col in frame.columns}
+    }
+
+def frame_from_json(data):
+    """Rebuild a frame written by frame_to_json"""
+    return pd.DataFrame({
+        col: pd.Series(values, dtype=data['dtypes'][col])
+        for col, values in data['columns'].items()
+    })
+
+def partial_to_json(partial):
+    """JSON-serializable form of a partial, e.g. to pass it between processes"""
+    return {name: frame_to_json(frame) for name, frame in partial.items()}
+
+def partial_from_json(data):
+    """Rebuild a partial written by partial_to_json"""
+    return {name: frame_from_json(frame) for name, frame in data.items()}
+
+def breakdown_page(partial, args):
+    """
+    One page of the drill-down table for the query args
+    (level, product_line, set_name, rarity, sort, order, page, per_page).
+    Returns the payload and any error.
+    """
+    level = args.get('level', 'product_line')
+    if level not in LEVELS:
+        return None, f"level must be one of {', '.join(LEVELS)}"
+    by = GROUP_COLUMNS[:LEVELS[level]]
+
+    sort = args.get('sort', 'value')
+    if sort not in SORT_KEYS:
+        return None, f"sort must be one of {', '.join(SORT_KEYS)}"
+    ascending = args.get('order', 'desc') == 'asc'
+
+    try:
+        page = max(1, int(args.get('page', 1)))
+        per_page = min(MAX_PER_PAGE, max(1, int(args.get('per_page', 50))))
+    except ValueError:
+        return None, "page and per_page must be integers"
+
+    groups = partial['groups']
+    movers = partial['movers']
+    filters = {}
+    for param, col in FILTER_PARAMS.items():
+        if param in args:
+            filters[param] = args[param]
+            groups = groups[groups[col] == args[param]]
+            movers = movers[movers[col] == args[param]]
+
+    table = groups.groupby(by, as_index=False)[STAT_COLUMNS].sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table['avg_change'] = table['diff_sum'] / table['diff_count']
+        table['avg_store_price'] = table['value'] / table['value_count']
+    table = table.sort_values(sort, ascending=ascending, kind='stable', na_position='last')
+
+    total_groups = len(table)
+    page_rows = table.iloc[(page - 1) * per_page:page * per_page]
+
+    # Top movers of the groups on this page only
+    page_movers = top_movers(movers.merge(page_rows[by], on=by), by)
+    movers_by_group = {
+        key if isinstance(key, tuple) else (key,): frame
+        for key, frame in page_movers.groupby(by, sort=False)
+    }
+
+    rows = []
+    for record in page_rows.to_dict('records'):
+        key = tuple(record[col] for col in by)
+        group_movers = movers_by_group.get(key, page_movers.iloc[0:0])
+        rows.append({
+            'group': {col: record[col] for col in by},
+            'count': int(record['count']),
+            'total_value': json_value(record['value'], 2),
+            'avg_store_price': json_value(record['avg_store_price'], 2),
+            'avg_change': json_value(record['avg_change'], 2),
+            'price_changes': {
+                'increased': int(record['increased']),
+                'decreased': int(record['decreased']),
+                'unchanged': int(record['unchanged'])
+            },
+            'top_movers': [
+                {col: json_value(mover[col], 2 if col in MONEY_MOVER_COLUMNS else None) for col in MOVER_COLUMNS if col in mover}
+                for mover in group_movers.to_dict('records')
+            ]
+        })
+
+    return {
+        'level': level,
+        'group_by': by,
+        'filters': filters,
+        'sort': sort,
+        'order': 'asc' if ascending else 'desc',
+        'page': page,
+        'per_page': per_page,
+        'total_groups': total_groups,
+        'total_pages': (total_groups + per_page - 1) // per_page,
+        'rows': rows
+    }, None
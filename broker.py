@@ -0,0 +1,313 @@
+"""
+Job broker for distributing pricing work to worker processes.
+
+A job starts as a split task that cuts the upload into shards; completing it
+queues one task per shard. A collect task only becomes runnable once the split
+and every shard are done. Workers lease one task at a time, heartbeat to keep
+the lease, and report it done or failed. Expired leases and failed tasks are
+handed out again until they run out of attempts. Completing the collect task
+finishes the job.
+
+Broker defines the interface; SQLiteBroker implements it on a shared
+directory holding a SQLite database, the working files of running jobs and
+the results of finished ones. Every host that runs a worker must mount the
+directory (on a filesystem with working locks).
+"""
+
+import abc
+import contextlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+
+class Broker(abc.ABC):
+    """
+    Interface of a shard broker. Payloads and results are JSON-serializable dicts.
+    """
+
+    @abc.abstractmethod
+    def submit_job(self, job_id, split_payload, collect_payload):
+        """Register a job with its split and collect tasks"""
+
+    @abc.abstractmethod
+    def lease_shard(self, worker_id, lease_seconds):
+        """
+        Lease the next runnable split, shard or collect task:
+        {'shard_id', 'job_id', 'kind', 'index', 'payload', 'attempts'} or None
+        """
+
+    @abc.abstractmethod
+    def heartbeat(self, shard_id, worker_id, lease_seconds):
+        """Extend a lease; False if the worker no longer holds it"""
+
+    @abc.abstractmethod
+    def complete_shard(self, shard_id, worker_id, result):
+        """
+        Store a shard's result. A split task's result lists the payloads of
+        the shards to queue ({'payloads': [...]}), a collect task's result is
+        the job's result. False if the worker no longer holds the lease.
+        """
+
+    @abc.abstractmethod
+    def fail_shard(self, shard_id, worker_id, error):
+        """Give a shard back for retry, or fail it once it is out of attempts"""
+
+    @abc.abstractmethod
+    def job_status(self, job_id):
+        """Job state and shard counts, or None for an unknown job"""
+
+    @abc.abstractmethod
+    def shard_results(self, job_id):
+        """Results of all shards of a job, in shard order"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS shards (
+    shard_id TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    worker_id TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS shards_by_job ON shards (job_id, idx);
+CREATE INDEX IF NOT EXISTS shards_by_status ON shards (status, lease_expires);
+"""
+
+class SQLiteBroker(Broker):
+    """
+    Broker backed by a SQLite database in a shared directory
+    """
+
+    def __init__(self, root, max_attempts=3):
+        self.root = root
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.join(root, 'jobs'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'results'), exist_ok=True)
+        self.db_path = os.path.join(root, 'broker.db')
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Autocommit connection; an unfinished BEGIN is rolled back on close
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def path(self, relative_path):
+        """Absolute path of a file stored relative to the broker root"""
+        return os.path.join(self.root, relative_path)
+
+    def job_dir(self, job_id):
+        """Relative directory for a job's working files (created on demand)"""
+        relative = os.path.join('jobs', job_id)
+        os.makedirs(self.path(relative), exist_ok=True)
+        return relative
+
+    def result_path(self, filename):
+        """Relative path of a finished job's output file"""
+        return os.path.join('results', filename)
+
+    def _remove_job_files(self, job_ids):
+        # Working files are only needed until the job is done or failed
+        for job_id in job_ids:
+            shutil.rmtree(self.path(os.path.join('jobs', job_id)), ignore_errors=True)
+
+    def new_job_id(self):
+        return uuid.uuid4().hex
+
+    def submit_job(self, job_id, split_payload, collect_payload):
+        tasks = [
+            (f"{job_id}-split", job_id, -1, 'split', json.dumps(split_payload)),
+            (f"{job_id}-collect", job_id, 0, 'collect', json.dumps(collect_payload))
+        ]
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO jobs (job_id, status, created) VALUES (?, 'running', ?)",
+                (job_id, time.time())
+            )
+            conn.executemany(
+                "INSERT INTO shards (shard_id, job_id, idx, kind, status, payload) VALUES (?, ?, ?, ?, 'pending', ?)",
+                tasks
+            )
+            conn.execute("COMMIT")
+
+    def lease_shard(self, worker_id, lease_seconds):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+
+            # Expired leases that used up their attempts fail their job
+            expired = conn.execute(
+                "SELECT shard_id, job_id FROM shards WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            ).fetchall()
+            for row in expired:
+                self._fail(conn, row['shard_id'], row['job_id'], "lease expired too many times")
+            failed_jobs = [row['job_id'] for row in expired]
+
+            # A collect task waits until the split and every shard of its job are done
+            row = conn.execute(
+                """
+                SELECT shards.* FROM shards JOIN jobs USING (job_id)
+                WHERE jobs.status = 'running'
+                  AND (shards.status = 'pending' OR (shards.status = 'leased' AND shards.lease_expires < ?))
+                  AND (shards.kind != 'collect' OR NOT EXISTS (
+                      SELECT 1 FROM shards AS other
+                      WHERE other.job_id = shards.job_id AND other.kind != 'collect' AND other.status != 'done'
+                  ))
+                ORDER BY jobs.created, shards.idx
+                LIMIT 1
+                """,
+                (now,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                self._remove_job_files(failed_jobs)
+                return None
+
+            conn.execute(
+                "UPDATE shards SET status = 'leased', worker_id = ?, lease_expires = ?, attempts = attempts + 1 WHERE shard_id = ?",
+                (worker_id, now + lease_seconds, row['shard_id'])
+            )
+            conn.execute("COMMIT")
+        self._remove_job_files(failed_jobs)
+
+        return {
+            'shard_id': row['shard_id'],
+            'job_id': row['job_id'],
+            'kind': row['kind'],
+            'index': row['idx'],
+            'payload': json.loads(row['payload']),
+            'attempts': row['attempts'] + 1
+        }
+
+    def heartbeat(self, shard_id, worker_id, lease_seconds):
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE shards SET lease_expires = ? WHERE shard_id = ? AND worker_id = ? AND status = 'leased'",
+                (time.time() + lease_seconds, shard_id, worker_id)
+            ).rowcount
+        return updated == 1
+
+    def complete_shard(self, shard_id, worker_id, result):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT job_id, kind FROM shards WHERE shard_id = ? AND worker_id = ? AND status = 'leased'",
+                (shard_id, worker_id)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE shards SET status = 'done', result = ?, lease_expires = NULL WHERE shard_id = ?",
+                    (json.dumps(result), shard_id)
+                )
+                if row['kind'] == 'split':
+                    self._add_shards(conn, row['job_id'], result['payloads'])
+                elif row['kind'] == 'collect':
+                    conn.execute(
+                        "UPDATE jobs SET status = 'done', result = ? WHERE job_id = ? AND status = 'running'",
+                        (json.dumps(result), row['job_id'])
+                    )
+            conn.execute("COMMIT")
+
+        if row is not None and row['kind'] == 'collect':
+            self._remove_job_files([row['job_id']])
+        return row is not None
+
+    def _add_shards(self, conn, job_id, payloads):
+        conn.executemany(
+            "INSERT INTO shards (shard_id, job_id, idx, kind, status, payload) VALUES (?, ?, ?, 'shard', 'pending', ?)",
+            [(f"{job_id}-{i}", job_id, i, json.dumps(payload)) for i, payload in enumerate(payloads)]
+        )
+        # Keep the collect task ordered after the shards it waits for
+        conn.execute(
+            "UPDATE shards SET idx = ? WHERE job_id = ? AND kind = 'collect'",
+            (len(payloads), job_id)
+        )
+
+    def fail_shard(self, shard_id, worker_id, error):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT job_id, attempts FROM shards WHERE shard_id = ? AND worker_id = ? AND status = 'leased'",
+                (shard_id, worker_id)
+            ).fetchone()
+            failed = row is not None and row['attempts'] >= self.max_attempts
+            if failed:
+                self._fail(conn, shard_id, row['job_id'], error)
+            elif row is not None:
+                conn.execute(
+                    "UPDATE shards SET status = 'pending', worker_id = NULL, lease_expires = NULL, error = ? WHERE shard_id = ?",
+                    (error, shard_id)
+                )
+            conn.execute("COMMIT")
+
+        if failed:
+            self._remove_job_files([row['job_id']])
+
+    def _fail(self, conn, shard_id, job_id, error):
+        conn.execute(
+            "UPDATE shards SET status = 'failed', error = ? WHERE shard_id = ?",
+            (error, shard_id)
+        )
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = ? WHERE job_id = ? AND status = 'running'",
+            (f"Shard {shard_id} failed: {error}", job_id)
+        )
+
+    def job_status(self, job_id):
+        with self._connect() as conn:
+            job = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM shards WHERE job_id = ? AND kind = 'shard' GROUP BY status",
+                (job_id,)
+            ).fetchall())
+            stages = dict(conn.execute(
+                "SELECT kind, status FROM shards WHERE job_id = ? AND kind != 'shard'",
+                (job_id,)
+            ).fetchall())
+
+        status = job['status']
+        if status == 'running' and stages.get('split') != 'done':
+            status = 'splitting'
+        elif status == 'running' and stages.get('collect') == 'leased':
+            status = 'collecting'
+        shards = {state: counts.get(state, 0) for state in ('pending', 'leased', 'done', 'failed')}
+        return {
+            'job_id': job_id,
+            'status': status,
+            'shards': shards,
+            'total_shards': sum(counts.values()),
+            'result': json.loads(job['result']) if job['result'] else None,
+            'error': job['error']
+        }
+
+    def shard_results(self, job_id):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT result FROM shards WHERE job_id = ? AND kind = 'shard' ORDER BY idx",
+                (job_id,)
+            ).fetchall()
+        return [json.loads(row['result']) if row['result'] else None for row in rows]
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Protocol checks for the job broker.
+
+Drives SQLiteBroker through the cases the happy path in check_equivalence.py
+never reaches: leases that expire and move to another worker, stale
+completions and heartbeats, retries up to max_attempts, and removal of a
+job's working files once it is done or failed. No pricing is involved; the
+payloads are placeholders.
+
+Usage: python check_broker.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from broker import SQLiteBroker
+
+# Long enough to hold a lease for the whole check, and one that is over at once
+HOLD_SECONDS = 60
+EXPIRE_SECONDS = 0.01
+
+def new_job(broker, shards=2):
+    """Submit a job with a working file in its directory and lease its split"""
+    job_id = broker.new_job_id()
+    with open(broker.path(os.path.join(broker.job_dir(job_id), 'current.csv')), 'w') as f:
+        f.write("TCGplayer Id\n")
+    broker.submit_job(job_id, {'shards': shards}, {'filename': f'{job_id}.csv'})
+    split = broker.lease_shard('splitter', HOLD_SECONDS)
+    broker.complete_shard(split['shard_id'], 'splitter', {'payloads': [{'index': i} for i in range(shards)]})
+    return job_id
+
+def expire():
+    time.sleep(EXPIRE_SECONDS * 5)
+
+def job_files_exist(broker, job_id):
+    return os.path.exists(broker.path(os.path.join('jobs', job_id)))
+
+def check_expired_lease_moves(broker):
+    """An expired lease goes to the next worker, and the first one loses it"""
+    job_id = new_job(broker, shards=1)
+    first = broker.lease_shard('w1', EXPIRE_SECONDS)
+    expire()
+    second = broker.lease_shard('w2', HOLD_SECONDS)
+    if second is None or second['shard_id'] != first['shard_id']:
+        return f"expired shard not re-leased: {second}"
+    if second['attempts'] != 2:
+        return f"attempts {second['attempts']} != 2"
+    if broker.heartbeat(first['shard_id'], 'w1', HOLD_SECONDS):
+        return "stale heartbeat accepted"
+    if broker.complete_shard(first['shard_id'], 'w1', {'rows': 0}):
+        return "stale complete_shard accepted"
+    if not broker.complete_shard(second['shard_id'], 'w2', {'rows': 0}):
+        return "current lease holder could not complete"
+    if broker.job_status(job_id)['shards']['done'] != 1:
+        return f"shard not done: {broker.job_status(job_id)}"
+    return None
+
+def check_collect_waits(broker):
+    """The collect task only runs once every shard is done, and finishing it cleans up"""
+    job_id = new_job(broker, shards=2)
+    first = broker.lease_shard('w1', HOLD_SECONDS)
+    second = broker.lease_shard('w2', HOLD_SECONDS)
+    if broker.lease_shard('w3', HOLD_SECONDS) is not None:
+        return "collect task leased before its shards were done"
+    broker.complete_shard(first['shard_id'], 'w1', {'rows': 1})
+    broker.complete_shard(second['shard_id'], 'w2', {'rows': 2})
+
+    collect = broker.lease_shard('w3', HOLD_SECONDS)
+    if collect is None or collect['kind'] != 'collect':
+        return f"collect task not leased: {collect}"
+    if broker.job_status(job_id)['status'] != 'collecting':
+        return f"status {broker.job_status(job_id)['status']} != collecting"
+    if broker.shard_results(job_id) != [{'rows': 1}, {'rows': 2}]:
+        return f"shard results {broker.shard_results(job_id)}"
+    broker.complete_shard(collect['shard_id'], 'w3', {'filename': 'out.csv'})
+
+    status = broker.job_status(job_id)
+    if status['status'] != 'done' or status['result'] != {'filename': 'out.csv'}:
+        return f"job not done: {status}"
+    if job_files_exist(broker, job_id):
+        return "job files left after the job was done"
+    return None
+
+def check_fail_retries(broker):
+    """fail_shard hands the shard out again until max_attempts, then fails the job"""
+    job_id = new_job(broker, shards=1)
+    for attempt in range(1, broker.max_attempts + 1):
+        shard = broker.lease_shard(f'w{attempt}', HOLD_SECONDS)
+        if shard is None or shard['attempts'] != attempt:
+            return f"attempt {attempt}: leased {shard}"
+        if not job_files_exist(broker, job_id):
+            return f"job files removed before attempt {attempt}"
+        broker.fail_shard(shard['shard_id'], f'w{attempt}', "boom")
+
+    status = broker.job_status(job_id)
+    if status['status'] != 'failed' or "boom" not in status['error']:
+        return f"job not failed: {status}"
+    if broker.lease_shard('w9', HOLD_SECONDS) is not None:
+        return "failed job still hands out tasks"
+    if job_files_exist(broker, job_id):
+        return "job files left after the job failed"
+    return None
+
+def check_expired_out_of_attempts(broker):
+    """A lease that keeps expiring fails the job once it is out of attempts"""
+    job_id = new_job(broker, shards=1)
+    for attempt in range(1, broker.max_attempts + 1):
+        broker.lease_shard(f'w{attempt}', EXPIRE_SECONDS)
+        expire()
+
+    if broker.lease_shard('w9', HOLD_SECONDS) is not None:
+        return "shard leased past max_attempts"
+    status = broker.job_status(job_id)
+    if status['status'] != 'failed' or "lease expired" not in status['error']:
+        return f"job not failed: {status}"
+    if job_files_exist(broker, job_id):
+        return "job files left after the job failed"
+    return None
+
+def check_failed_split(broker):
+    """A split that fails for good fails the job before any shard exists"""
+    job_id = broker.new_job_id()
+    broker.job_dir(job_id)
+    broker.submit_job(job_id, {}, {})
+    for attempt in range(1, broker.max_attempts + 1):
+        split = broker.lease_shard('w1', HOLD_SECONDS)
+        if split is None or split['kind'] != 'split':
+            return f"attempt {attempt}: leased {split}"
+        if broker.job_status(job_id)['status'] != 'splitting':
+            return f"status {broker.job_status(job_id)['status']} != splitting"
+        broker.fail_shard(split['shard_id'], 'w1', "bad upload")
+
+    status = broker.job_status(job_id)
+    if status['status'] != 'failed' or status['total_shards'] != 0:
+        return f"job not failed: {status}"
+    if job_files_exist(broker, job_id):
+        return "job files left after the job failed"
+    return None
+
+CHECKS = {
+    'expired lease': check_expired_lease_moves,
+    'collect waits': check_collect_waits,
+    'fail retries': check_fail_retries,
+    'lease expiry': check_expired_out_of_attempts,
+    'failed split': check_failed_split
+}
+
+def main():
+    print("🧪 TCG Pricing Calculator - Broker Check")
+    print("=" * 50)
+
+    failures = 0
+    for name, check in CHECKS.items():
+        # Each check gets its own broker so leftover tasks can't leak into the next
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                mismatch = check(SQLiteBroker(directory, max_attempts=3))
+            except Exception as e:
+                mismatch = f"error: {e}"
+        if mismatch:
+            failures += 1
+            print(f"❌ {name:<16} {mismatch}")
+        else:
+            print(f"✅ {name}")
+
+    print("-" * 50)
+    if failures:
+        print(f"❌ {failures} broker checks failed")
+        return 1
+    print(f"✅ All {len(CHECKS)} broker checks passed")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
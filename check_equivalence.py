@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Golden-equivalence harness for the pricing engines.
+
+Generates adversarial previous/current CSV pairs and checks that every
+pipeline mode produces exactly the same prices, CSV export, summary and
+per-group breakdown as the reference calculate_* functions in app.py. Each
+mode's runtime is recorded next to its comparison.
+
+Every mode, the reference included, is also checked against the committed
+golden files in golden/ (a hand-checked input pair with its expected export
+and summary), so a regression in app.py itself is caught too.
+
+Usage: python check_equivalence.py [--cases 25] [--rows 500] [--seed 0]
+                                   [--bench-rows 100000] [--report report.json]
+                                   [--update-golden]
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import app
+import app_large_files
+import pricing
+import worker
+from arrow_pricing import process_pricing_data_arrow
+from breakdown import breakdown_page, group_partials, partial_from_json
+from broker import SQLiteBroker
+from csv_export import write_pricing_csv
+
+# Columns compared value-for-value (NaN equals NaN)
+PRICE_COLUMNS = [
+    "TCGplayer Id",
+    "Old Multiplier",
+    "Base Price",
+    "Multiplier",
+    "My Store Price",
+    "Old My Store Price",
+    "Diff"
+]
+
+# Values chosen to hit rounding near-ties, the quantity bumps and the multiplier branches
+PRICE_POOL = [None, "NA", 0, 0.01, 0.004999, 0.005, 0.125, 0.145, 0.285, 1.005, 2.675, 0.1, 0.15, 0.25, 19.99, 1234.565, 50000]
+QUANTITY_POOL = [None, 0, 1, 19, 20, 39, 40, 100]
+MULTIPLIER_POOL = [None, 1.2, 1.05, 1.04, 1.06, 1.0, 0.95, 1.5, 2.345]
+# Text that pandas reads as NaN: every engine must agree on these
+NA_TOKENS = ["None", "NA", "<NA>", "null", "N/A", "nan"]
+CONDITION_POOL = ["Near Mint", "Lightly Played", "Damaged", "Unopened", None, "NA"]
+SET_POOL = ["Alpha", "Beta", "Set, With Comma", None] + NA_TOKENS
+RARITY_POOL = ["Common", "Uncommon", "Rare", "Mythic", None] + NA_TOKENS
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+def random_price(rng):
+    """Mostly cents, sometimes a tricky pooled value or sub-cent precision"""
+    roll = rng.random()
+    if roll < 0.4:
+        return rng.choice(PRICE_POOL)
+    if roll < 0.8:
+        return rng.randint(1, 100000) / 100
+    return rng.randint(1, 1000000) / 1000
+
+def write_rows(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(['' if value is None else value for value in row])
+
+def generate_case(rng, rows, directory):
+    """
+    Write one adversarial previous/current pair and return their paths.
+    Optional columns are randomly dropped so the defaults get exercised.
+    """
+    id_range = max(2, rows // 2)
+    # Blank ids join with each other, so keep their count small on big cases
+    missing_id_rate = min(0.03, 20 / rows)
+
+    def random_id():
+        return None if rng.random() < missing_id_rate else rng.randint(1, id_range)
+
+    # previous.csv: duplicate ids, missing and boundary multipliers
+    previous_header = ["TCGplayer Id", "Product Name", "Old Multiplier"]
+    if rng.random() < 0.15:
+        previous_header.remove("Old Multiplier")
+    previous_rows = []
+    for i in range(rows):
+        row = {"TCGplayer Id": random_id(), "Product Name": f"Card {i}", "Old Multiplier": rng.choice(MULTIPLIER_POOL)}
+        previous_rows.append([row[col] for col in previous_header])
+
+    # current.csv: NA prices and quantities, Unopened rows, blank groups, text needing quotes,
+    # a boolean passthrough column
+    current_header = [
+        "TCGplayer Id", "Product Line", "Set Name", "Product Name", "Rarity", "Condition",
+        "TCG Market Price", "TCG Low Price", "Total Quantity",
+        "Old Qty", "My Store Price", "TCG Marketplace Price", "Photo URL", "Foil"
+    ]
+    for optional in ["Rarity", "Old Qty", "My Store Price", "TCG Marketplace Price", "Foil"]:
+        if rng.random() < 0.3:
+            current_header.remove(optional)
+    low_missing = rng.random() < 0.1
+
+    current_rows = []
+    for i in range(rows):
+        row = {
+            "TCGplayer Id": random_id(),
+            "Product Line": rng.choice(["Magic: The Gathering", "Pokemon"]),
+            "Set Name": rng.choice(SET_POOL),
+            "Rarity": rng.choice(RARITY_POOL),
+            "Product Name": f'Card {i}, "Foil"' if rng.random() < 0.1 else f"Card {i}",
+            "Condition": rng.choice(CONDITION_POOL),
+            "TCG Market Price": random_price(rng),
+            "TCG Low Price": None if low_missing else random_price(rng),
+            "Total Quantity": rng.choice(QUANTITY_POOL),
+            "Old Qty": rng.choice(QUANTITY_POOL),
+            "My Store Price": random_price(rng),
+            "TCG Marketplace Price": random_price(rng),
+            "Photo URL": rng.choice([None, "None"]) if rng.random() < 0.2 else f"https://example.com/card{i}.jpg",
+            # Read back as a boolean column, which must export as True/False
+            "Foil": rng.choice([True, False, None])
+        }
+        current_rows.append([row[col] for col in current_header])
+
+    previous_path = os.path.join(directory, 'previous.csv')
+    current_path = os.path.join(directory, 'current.csv')
+    write_rows(previous_path, previous_header, previous_rows)
+    write_rows(current_path, current_header, current_rows)
+    return previous_path, current_path
+
+def export_bytes(merged_df):
+    output = io.BytesIO()
+    write_pricing_csv(merged_df, output)
+    return output.getvalue()
+
+# --- PIPELINE MODES ---
+# Each mode returns (priced DataFrame or None, exported CSV bytes, summary, breakdown partial)
+
+def run_reference(previous_path, current_path, directory):
+    merged, error = app.process_pricing_data(previous_path, current_path)
+    if error:
+        raise RuntimeError(error)
+    return merged, export_bytes(merged), pricing.build_summary(merged), group_partials(merged)
+
+def run_large(previous_path, current_path, directory):
+    merged, error = pricing.process_pricing_data_large(previous_path, current_path)
+    if error:
+        raise RuntimeError(error)
+    return merged, export_bytes(merged), pricing.build_summary(merged), group_partials(merged)
+
+def run_streaming(previous_path, current_path, directory):
+    # Small cases use a tiny chunk size so chunk boundaries split duplicate ids
+    chunk_size = app_large_files.STREAMING_CHUNK_SIZE
+    if app_large_files.count_csv_rows(current_path) < chunk_size:
+        chunk_size = 7
+    output_path = os.path.join(directory, 'streaming.csv')
+    result, error = pricing.process_pricing_data_streaming(
+        previous_path, current_path, output_path, chunk_size=chunk_size
+    )
+    if error:
+        raise RuntimeError(error)
+    with open(output_path, 'rb') as f:
+        return None, f.read(), result['summary'], result['breakdown']
+
+def run_sharded(previous_path, current_path, directory):
+    # Same small-case trick as streaming: tiny shards split duplicate ids
+    shard_rows = app_large_files.STREAMING_CHUNK_SIZE
+    if app_large_files.count_csv_rows(current_path) < shard_rows:
+        shard_rows = 7
+    broker = SQLiteBroker(os.path.join(directory, 'broker'))
+    # Submitting moves the uploads into the broker directory
+    previous_upload = os.path.join(directory, 'previous_upload.csv')
+    current_upload = os.path.join(directory, 'current_upload.csv')
+    shutil.copyfile(previous_path, previous_upload)
+    shutil.copyfile(current_path, current_upload)
+    job_id, error = app_large_files.submit_pricing_job(broker, previous_upload, current_upload, shard_rows=shard_rows)
+    if error:
+        raise RuntimeError(error)
+    worker.run_worker(broker, worker_id='check', exit_when_idle=True)
+    status = broker.job_status(job_id)
+    if status['status'] != 'done':
+        raise RuntimeError(f"job not finished: {status}")
+    if os.path.exists(broker.path(os.path.join('jobs', job_id))):
+        raise RuntimeError("job files were not removed")
+
+    filename = status['result']['filename']
+    with open(broker.path(broker.result_path(app_large_files.job_breakdown_filename(filename)))) as f:
+        breakdown = partial_from_json(json.load(f))
+    with open(broker.path(broker.result_path(filename)), 'rb') as f:
+        return None, f.read(), status['result']['summary'], breakdown
+
+def run_arrow(previous_path, current_path, directory):
+    merged, error = process_pricing_data_arrow(previous_path, current_path)
+    if error:
+        raise RuntimeError(error)
+    return merged, export_bytes(merged), pricing.build_summary(merged), group_partials(merged)
+
+MODES = {
+    'large': run_large,
+    'streaming': run_streaming,
+    'sharded': run_sharded,
+    'arrow': run_arrow
+}
+
+def compare_frames(expected, actual):
+    """Return a description of the first difference, or None"""
+    if len(expected) != len(actual):
+        return f"row count {len(actual)} != {len(expected)}"
+    if list(expected.columns) != list(actual.columns):
+        return f"columns {list(actual.columns)} != {list(expected.columns)}"
+    for col in PRICE_COLUMNS:
+        want = expected[col].astype('float64').to_numpy(na_value=np.nan)
+        got = actual[col].astype('float64').to_numpy(na_value=np.nan)
+        if not np.array_equal(want, got, equal_nan=True):
+            row = int(np.flatnonzero(~((want == got) | (np.isnan(want) & np.isnan(got))))[0])
+            return f"{col} row {row}: {got[row]!r} != {want[row]!r}"
+    return None
+
+def compare_exports(expected, actual):
+    if expected == actual:
+        return None
+    expected_lines = expected.decode('utf-8').split('\n')
+    actual_lines = actual.decode('utf-8').split('\n')
+    for line, (want, got) in enumerate(zip(expected_lines, actual_lines)):
+        if want != got:
+            return f"csv line {line}: {got!r} != {want!r}"
+    return f"csv line count {len(actual_lines)} != {len(expected_lines)}"
+
+def breakdown_rows(partial):
+    """Every finest-level breakdown row, in a stable order"""
+    payload, error = breakdown_page(partial, {'level': 'rarity', 'sort': 'count', 'per_page': '500'})
+    rows = payload['rows']
+    for page in range(2, payload['total_pages'] + 1):
+        more, error = breakdown_page(partial, {'level': 'rarity', 'sort': 'count', 'per_page': '500', 'page': str(page)})
+        rows.extend(more['rows'])
+    return sorted(rows, key=lambda row: tuple(row['group'].values()))
+
+def compare_breakdowns(expected, actual):
+    """
+    Counts and movers must match exactly. Group sums taken in a different
+    order (e.g. per streaming chunk) may round one cent apart.
+    """
+    expected_rows = breakdown_rows(expected)
+    actual_rows = breakdown_rows(actual)
+    if len(expected_rows) != len(actual_rows):
+        return f"breakdown group count {len(actual_rows)} != {len(expected_rows)}"
+    for want, got in zip(expected_rows, actual_rows):
+        for key in want:
+            if key in ('total_value', 'avg_store_price', 'avg_change') and want[key] is not None and got[key] is not None:
+                if abs(want[key] - got[key]) > 0.011:
+                    return f"breakdown {want['group']} {key}: {got[key]} != {want[key]}"
+            elif want[key] != got[key]:
+                return f"breakdown {want['group']} {key}: {got[key]} != {want[key]}"
+    return None
+
+def timed(mode, previous_path, current_path, directory):
+    """Run a mode quietly and return its result and runtime"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = mode(previous_path, current_path, directory)
+    return result, time.perf_counter() - start
+
+def check_case(name, previous_path, current_path, directory):
+    """Compare every mode against the reference for one input pair"""
+    (expected_df, expected_csv, expected_summary, expected_breakdown), reference_seconds = timed(
+        run_reference, previous_path, current_path, directory
+    )
+    results = [{
+        'case': name,
+        'mode': 'reference',
+        'rows': len(expected_df),
+        'seconds': round(reference_seconds, 4),
+        'identical': True,
+        'mismatch': None
+    }]
+
+    for mode_name, mode in MODES.items():
+        try:
+            (actual_df, actual_csv, actual_summary, actual_breakdown), seconds = timed(
+                mode, previous_path, current_path, directory
+            )
+            mismatch = None
+            if actual_df is not None:
+                mismatch = compare_frames(expected_df, actual_df)
+            if mismatch is None:
+                mismatch = compare_exports(expected_csv, actual_csv)
+            if mismatch is None and actual_summary != expected_summary:
+                mismatch = f"summary {actual_summary} != {expected_summary}"
+            if mismatch is None:
+                mismatch = compare_breakdowns(expected_breakdown, actual_breakdown)
+        except Exception as e:
+            seconds = 0.0
+            mismatch = f"error: {e}"
+
+        results.append({
+            'case': name,
+            'mode': mode_name,
+            'rows': len(expected_df),
+            'seconds': round(seconds, 4),
+            'identical': mismatch is None,
+            'mismatch': mismatch
+        })
+    return results
+
+def json_summary(summary):
+    """The summary as it reads back from JSON, for comparing with the golden file"""
+    return json.loads(json.dumps(summary))
+
+def check_golden(directory):
+    """Compare every mode, the reference included, with the golden files"""
+    previous_path = os.path.join(GOLDEN_DIR, 'previous.csv')
+    current_path = os.path.join(GOLDEN_DIR, 'current.csv')
+    with open(os.path.join(GOLDEN_DIR, 'expected.csv'), 'rb') as f:
+        expected_csv = f.read()
+    with open(os.path.join(GOLDEN_DIR, 'expected_summary.json')) as f:
+        expected_summary = json.load(f)
+
+    results = []
+    for mode_name, mode in {'reference': run_reference, **MODES}.items():
+        try:
+            (_, actual_csv, actual_summary, _), seconds = timed(mode, previous_path, current_path, directory)
+            mismatch = compare_exports(expected_csv, actual_csv)
+            if mismatch is None and json_summary(actual_summary) != expected_summary:
+                mismatch = f"summary {json_summary(actual_summary)} != {expected_summary}"
+        except Exception as e:
+            seconds = 0.0
+            mismatch = f"error: {e}"
+
+        results.append({
+            'case': 'golden',
+            'mode': mode_name,
+            'rows': expected_csv.count(b'\n') - 1,
+            'seconds': round(seconds, 4),
+            'identical': mismatch is None,
+            'mismatch': mismatch
+        })
+    return results
+
+def update_golden(directory):
+    """Rewrite the expected golden files from app.py (review the diff before committing)"""
+    (_, csv_bytes, summary, _), _ = timed(
+        run_reference,
+        os.path.join(GOLDEN_DIR, 'previous.csv'),
+        os.path.join(GOLDEN_DIR, 'current.csv'),
+        directory
+    )
+    with open(os.path.join(GOLDEN_DIR, 'expected.csv'), 'wb') as f:
+        f.write(csv_bytes)
+    with open(os.path.join(GOLDEN_DIR, 'expected_summary.json'), 'w') as f:
+        json.dump(json_summary(summary), f, indent=2)
+        f.write('\n')
+    print(f"📝 Golden files updated in {GOLDEN_DIR}")
+
+def print_results(results):
+    for result in results:
+        status = "✅" if result['identical'] else "❌"
+        line = f"{status} {result['case']:<12} {result['mode']:<10} {result['rows']:>8} rows {result['seconds']:>9.4f}s"
+        if result['mismatch']:
+            line += f"  {result['mismatch']}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that every pricing mode matches app.py")
+    parser.add_argument('--cases', type=int, default=25, help="number of random adversarial cases")
+    parser.add_argument('--rows', type=int, default=500, help="rows per adversarial case")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first case")
+    parser.add_argument('--bench-rows', type=int, default=0, help="also time a case of this many rows")
+    parser.add_argument('--report', help="write all results as JSON to this path")
+    parser.add_argument('--update-golden', action='store_true', help="rewrite golden/expected_* from app.py and exit")
+    args = parser.parse_args()
+
+    if args.update_golden:
+        with tempfile.TemporaryDirectory() as directory:
+            update_golden(directory)
+        return 0
+
+    print("🧪 TCG Pricing Calculator - Equivalence Check")
+    print("=" * 50)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        results.extend(check_golden(directory))
+
+        for seed in range(args.seed, args.seed + args.cases):
+            rng = random.Random(seed)
+            previous_path, current_path = generate_case(rng, args.rows, directory)
+            results.extend(check_case(f"seed-{seed}", previous_path, current_path, directory))
+
+        if args.bench_rows:
+            rng = random.Random(args.seed)
+            previous_path, current_path = generate_case(rng, args.bench_rows, directory)
+            results.extend(check_case(f"bench-{args.bench_rows}", previous_path, current_path, directory))
+
+    print_results(results)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"📄 Report written to {args.report}")
+
+    failures = [result for result in results if not result['identical']]
+    print("-" * 50)
+    if failures:
+        print(f"❌ {len(failures)} mode/case combinations differ from the reference")
+        return 1
+    print(f"✅ All modes identical across {len(results)} runs")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+Columnar CSV writer for the final pricing export.
+
+Every column is turned into Arrow text in one vectorized pass per block:
+money columns get fixed two-decimal formatting, text is quoted only when it
+needs to be, and rows are joined inside Arrow so each block is written to the
+file as a single buffer.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from pricing_common import round2, to_float_array
+
+# Columns written with fixed two-decimal precision
+MONEY_COLUMNS = {
+    "TCG Market Price",
+    "TCG Direct Low",
+    "TCG Low Price With Shipping",
+    "TCG Low Price",
+    "TCG Marketplace Price",
+    "Old Marketplace Price",
+    "Old My Store Price",
+    "Base Price",
+    "My Store Price",
+    "Diff"
+}
+
+# Columns of TCGplayer's bulk upload format, in upload order
+TCGPLAYER_UPLOAD_COLUMNS = [
+    "TCGplayer Id",
+    "Product Line",
+    "Set Name",
+    "Product Name",
+    "Title",
+    "Number",
+    "Rarity",
+    "Condition",
+    "TCG Market Price",
+    "TCG Direct Low",
+    "TCG Low Price With Shipping",
+    "TCG Low Price",
+    "Total Quantity",
+    "Add to Quantity",
+    "TCG Marketplace Price",
+    "My Store Reserve Quantity",
+    "My Store Price",
+    "Photo URL"
+]
+
+# Export columns the priced frame holds under another name. prepare_current
+# renames the uploaded marketplace price, and pricing only sets My Store Price,
+# so the marketplace price is uploaded unchanged.
+COLUMN_SOURCES = {
+    "TCG Marketplace Price": "Old Marketplace Price"
+}
+
+EXPORT_FORMATS = {
+    'full': None,
+    'tcgplayer': TCGPLAYER_UPLOAD_COLUMNS
+}
+
+BLOCK_ROWS = 65536
+
+def format_money(values):
+    """Format floats as fixed two-decimal strings; NaN becomes null"""
+    values = round2(values)
+    missing = ~np.isfinite(values)
+    cents = np.rint(np.where(missing, 0.0, values) * 100).astype(np.int64)
+    negative = cents < 0
+    cents = np.abs(cents)
+
+    units = pa.array(cents // 100).cast(pa.string())
+    fraction = pc.utf8_lpad(pa.array(cents % 100).cast(pa.string()), 2, '0')
+    text = pc.binary_join_element_wise(units, fraction, '.')
+    text = pc.if_else(pa.array(negative), pc.binary_join_element_wise('-', text, ''), text)
+    return pc.if_else(pa.array(missing), pa.scalar(None, pa.string()), text)
+
+def quote_text(values):
+    """Quote the strings that contain a delimiter, quote or newline"""
+    needs_quotes = pc.match_substring_regex(values, '[",\r\n]')
+    quoted = pc.binary_join_element_wise('"', pc.replace_substring(values, '"', '""'), '"', '')
+    return pc.if_else(needs_quotes, quoted, values)
+
+def column_to_text(series, money):
+    """Render one column of a block as an Arrow string array"""
+    if money:
+        return format_money(to_float_array(series))
+
+    try:
+        values = pa.array(series, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed object columns: fall back to their Python string form
+        values = pa.array(series.astype(str).where(series.notna()), from_pandas=True)
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    if pa.types.is_dictionary(values.type):
+        values = values.dictionary_decode()
+
+    if pa.types.is_string(values.type) or pa.types.is_large_string(values.type):
+        return quote_text(values.cast(pa.string()))
+    if pa.types.is_boolean(values.type):
+        # Arrow casts to true/false; keep the True/False that to_csv writes
+        return pc.if_else(values, 'True', 'False')
+    return values.cast(pa.string())
+
+def lines_buffer(lines):
+    """Contiguous bytes of a string array (the rows of one block)"""
+    offsets = np.frombuffer(lines.buffers()[1], dtype=np.int32)
+    offsets = offsets[lines.offset:lines.offset + len(lines) + 1]
+    return memoryview(lines.buffers()[2])[offsets[0]:offsets[-1]]
+
+def select_columns(merged_df, columns):
+    """
+    The export columns in order. A column the frame lacks is taken from its
+    COLUMN_SOURCES entry, or written blank, so the layout always matches.
+    """
+    selected = {}
+    for col in columns:
+        source = col if col in merged_df.columns else COLUMN_SOURCES.get(col)
+        if source in merged_df.columns:
+            selected[col] = merged_df[source]
+        else:
+            selected[col] = pd.Series(np.nan, index=merged_df.index)
+    return pd.DataFrame(selected, index=merged_df.index)
+
+def write_pricing_csv(merged_df, path_or_buffer, columns=None, header=True, append=False, block_rows=BLOCK_ROWS):
+    """
+    Write a priced DataFrame as CSV.
+    columns limits (and orders) the output, see select_columns.
+    path_or_buffer may be a file path or a binary file object.
+    """
+    if columns is not None:
+        merged_df = select_columns(merged_df, columns)
+    names = list(merged_df.columns)
+    money = [name in MONEY_COLUMNS for name in names]
+
+    if hasattr(path_or_buffer, 'write'):
+        f = path_or_buffer
+        close = False
+    else:
+        f = open(path_or_buffer, 'ab' if append else 'wb')
+        close = True
+
+    try:
+        if header:
+            header_line = quote_text(pa.array(names, type=pa.string()))
+            f.write((','.join(header_line.to_pylist()) + '\n').encode('utf-8'))
+
+        for start in range(0, len(merged_df), block_rows):
+            block = merged_df.iloc[start:start + block_rows]
+            texts = [
+                column_to_text(block.iloc[:, i], money[i])
+                for i in range(len(names))
+            ]
+            rows = pc.binary_join_element_wise(
+                *texts, ',', null_handling='replace', null_replacement=''
+            )
+            rows = pc.binary_join_element_wise(rows, '', '\n')
+            f.write(lines_buffer(rows))
+    finally:
+        if close:
+            f.close()
@@ -0,0 +1,231 @@
+"""
+Top price movers and anomaly flags for a pricing run.
+
+Each frame (or streaming chunk) is reduced to its top-K candidates with
+np.argpartition, so only K rows are ever sorted. Candidates from successive
+chunks are merged into bounded heaps, which keeps the result identical to a
+single pass over the whole frame.
+"""
+
+import heapq
+
+import numpy as np
+
+from pricing_common import current_row_masks, to_float_array
+from breakdown import json_value
+
+TOP_MOVERS = 20
+ANOMALY_SAMPLES = 20
+
+# Normal multiplier steps are at most 0.05, anything larger is a reset or bad input
+MULTIPLIER_JUMP_THRESHOLD = 0.1
+
+ROW_COLUMNS = [
+    "TCGplayer Id",
+    "Product Name",
+    "Set Name",
+    "Condition",
+    "Old My Store Price",
+    "My Store Price",
+    "Diff",
+    "Base Price",
+    "Old Multiplier",
+    "Multiplier"
+]
+MONEY_COLUMNS = {"Old My Store Price", "My Store Price", "Diff", "Base Price"}
+
+# Rows dropped for a missing TCG Market Price never get priced, so the pipelines
+# tally them up front and attach the tally to the priced frame under this attrs key
+MISSING_MARKET_ATTR = 'missing_market_price'
+# Text columns copied into the sample rows, next to the id and TCG Low Price
+MISSING_MARKET_COLUMNS = ["Product Name", "Set Name", "Condition"]
+
+def missing_market_rows(current, samples=ANOMALY_SAMPLES):
+    """
+    Tally the rows of a raw current.csv frame (or chunk) that pricing drops
+    for a missing TCG Market Price; Unopened rows are dropped regardless.
+    Those that also lack a TCG Low Price have no price to go on at all.
+    Returns {'count', 'fallback_count', 'rows'} with the first samples rows.
+    """
+    not_unopened, has_market = current_row_masks(current)
+    dropped = current[not_unopened & ~has_market]
+
+    if "TCG Low Price" in dropped.columns:
+        low = to_float_array(dropped["TCG Low Price"])
+    else:
+        low = np.full(len(dropped), np.nan)
+
+    sample = dropped.iloc[:samples]
+    ids = to_float_array(sample["TCGplayer Id"]) if "TCGplayer Id" in sample.columns else np.full(len(sample), np.nan)
+    columns = [col for col in MISSING_MARKET_COLUMNS if col in sample.columns]
+    rows = []
+    for i, record in enumerate(sample[columns].to_dict('records')):
+        row = {"TCGplayer Id": None if np.isnan(ids[i]) else int(ids[i])}
+        row.update({col: json_value(record[col]) for col in columns})
+        row["TCG Low Price"] = json_value(low[i], 2)
+        rows.append(row)
+
+    return {
+        'count': len(dropped),
+        'fallback_count': int(np.isnan(low).sum()),
+        'rows': rows
+    }
+
+def top_k(scores, k):
+    """
+    Indices of the k largest non-NaN scores, largest first.
+    Ties go to the earliest row so the result doesn't depend on chunking.
+    """
+    candidates = np.flatnonzero(~np.isnan(scores))
+    if len(candidates) > k:
+        values = scores[candidates]
+        threshold = values[np.argpartition(-values, k - 1)[:k]].min()
+        above = candidates[values > threshold]
+        ties = candidates[values == threshold][:k - len(above)]
+        candidates = np.concatenate([above, ties])
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+class MoversTracker:
+    """
+    Running top movers and anomalies over one or more priced frames
+    """
+
+    def __init__(self, top_n=TOP_MOVERS, samples=ANOMALY_SAMPLES):
+        self.top_n = top_n
+        self.samples = samples
+        self.rows_seen = 0
+        self.jump_count = 0
+        self.missing_market = {'count': 0, 'fallback_count': 0, 'rows': []}
+        self.limits = {
+            'increases': top_n,
+            'decreases': top_n,
+            'pct_increases': top_n,
+            'pct_decreases': top_n,
+            'multiplier_jump': samples
+        }
+        self.heaps = {name: [] for name in self.limits}
+
+    def update(self, merged_df):
+        """Fold one priced frame into the running results"""
+        n = len(merged_df)
+        if MISSING_MARKET_ATTR in merged_df.attrs:
+            self._add_missing_market(merged_df.attrs[MISSING_MARKET_ATTR])
+
+        diff = to_float_array(merged_df["Diff"])
+        old_price = to_float_array(merged_df["Old My Store Price"])
+        multiplier = to_float_array(merged_df["Multiplier"])
+        old_multiplier = to_float_array(merged_df["Old Multiplier"])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pct = np.where(old_price > 0, diff / old_price * 100, np.nan)
+            jump = np.abs(multiplier - old_multiplier)
+        jumped = jump > MULTIPLIER_JUMP_THRESHOLD
+        self.jump_count += int(jumped.sum())
+
+        scores = {
+            'increases': np.where(diff > 0, diff, np.nan),
+            'decreases': np.where(diff < 0, -diff, np.nan),
+            'pct_increases': np.where(pct > 0, pct, np.nan),
+            'pct_decreases': np.where(pct < 0, -pct, np.nan),
+            'multiplier_jump': np.where(jumped, jump, np.nan)
+        }
+
+        columns = [col for col in ROW_COLUMNS if col in merged_df.columns]
+        for name, score in scores.items():
+            picked = top_k(score, self.limits[name])
+            if not len(picked):
+                continue
+            records = merged_df.iloc[picked][columns].to_dict('records')
+            candidates = []
+            for index, record in zip(picked, records):
+                row = {
+                    col: json_value(record[col], 2 if col in MONEY_COLUMNS else None)
+                    for col in columns
+                }
+                row['Change Pct'] = json_value(pct[index], 2)
+                candidates.append((score[index], -(self.rows_seen + index), row))
+            self._push(name, candidates)
+
+        self.rows_seen += n
+
+    def merge(self, other):
+        """
+        Fold in a tracker built over the rows that come after this one's
+        (e.g. the next shard of a distributed job)
+        """
+        offset = self.rows_seen
+        for name, heap in other.heaps.items():
+            # Row numbers of the other tracker start at zero, shift them past ours
+            self._push(name, [(score, order - offset, row) for score, order, row in heap])
+
+        self.rows_seen += other.rows_seen
+        self.jump_count += other.jump_count
+        self._add_missing_market(other.missing_market)
+
+    def _add_missing_market(self, missing):
+        self.missing_market = {
+            'count': self.missing_market['count'] + missing['count'],
+            'fallback_count': self.missing_market['fallback_count'] + missing['fallback_count'],
+            'rows': (self.missing_market['rows'] + missing['rows'])[:self.samples]
+        }
+
+    def state(self):
+        """JSON-serializable state, e.g. to hand a shard's tracker to the collector"""
+        return {
+            'top_n': self.top_n,
+            'samples': self.samples,
+            'rows_seen': self.rows_seen,
+            'jump_count': self.jump_count,
+            'missing_market': self.missing_market,
+            'heaps': {
+                name: [[float(score), int(order), row] for score, order, row in heap]
+                for name, heap in self.heaps.items()
+            }
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a tracker from state()"""
+        tracker = cls(state['top_n'], state['samples'])
+        tracker.rows_seen = state['rows_seen']
+        tracker.jump_count = state['jump_count']
+        tracker.missing_market = state['missing_market']
+        tracker.heaps = {
+            name: [(score, order, row) for score, order, row in heap]
+            for name, heap in state['heaps'].items()
+        }
+        return tracker
+
+    def _push(self, name, candidates):
+        self.heaps[name] = heapq.nlargest(
+            self.limits[name], self.heaps[name] + candidates, key=lambda c: (c[0], c[1])
+        )
+
+    def result(self):
+        """Top movers and anomalies, ready to be returned with the summary"""
+        def rows(name):
+            return [row for _, _, row in self.heaps[name]]
+
+        return {
+            'top_movers': {
+                'increases': rows('increases'),
+                'decreases': rows('decreases'),
+                'pct_increases': rows('pct_increases'),
+                'pct_decreases': rows('pct_decreases')
+            },
+            'anomalies': {
+                'multiplier_jump': {
+                    'count': self.jump_count,
+                    'threshold': MULTIPLIER_JUMP_THRESHOLD,
+                    'rows': rows('multiplier_jump')
+                },
+                'missing_market_price': dict(self.missing_market)
+            }
+        }
+
+def find_movers(merged_df):
+    """Top movers and anomalies of a fully loaded result"""
+    tracker = MoversTracker()
+    tracker.update(merged_df)
+    return tracker.result()
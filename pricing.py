@@ -0,0 +1,351 @@
+"""
+Pandas pricing pipeline shared by the large file app and worker.py.
+
+Loads and prepares previous.csv and current.csv, prices them in memory or one
+chunk at a time, and builds the summary from running totals that can be
+merged across chunks and shards. Importing it has no side effects.
+"""
+
+import pandas as pd
+
+from breakdown import combine_partials, group_partials
+from csv_export import write_pricing_csv
+from movers import MISSING_MARKET_ATTR, MoversTracker, find_movers, missing_market_rows
+from pricing_common import current_row_masks, rename_current_columns
+
+def process_csv_chunked(file_path, file_type):
+    """
+    Process large CSV files in chunks to handle 300MB+ files
+    """
+    try:
+        # Read CSV in chunks
+        chunk_size = 10000  # Process 10k rows at a time
+        chunks = []
+        
+        print(f"Processing {file_type} file: {file_path}")
+        
+        for chunk in pd.read_csv(file_path, chunksize=chunk_size, encoding='utf-8-sig'):
+            chunks.append(chunk)
+            print(f"Processed chunk of {len(chunk)} rows")
+        
+        # Combine all chunks
+        df = pd.concat(chunks, ignore_index=True)
+        print(f"Total rows in {file_type}: {len(df)}")
+        
+        return df, None
+        
+    except Exception as e:
+        return None, str(e)
+
+# Define required columns for previous.csv
+REQUIRED_PREVIOUS_COLUMNS = {
+    "TCGplayer Id": 'Int64',
+    "Product Line": 'string',
+    "Set Name": 'string',
+    "Product Name": 'string',
+    "Title": 'string',
+    "Number": 'string',
+    "Rarity": 'string',
+    "Condition": 'string',
+    "TCG Market Price": 'float64',
+    "TCG Direct Low": 'float64',
+    "TCG Low Price With Shipping": 'float64',
+    "TCG Low Price": 'float64',
+    "Total Quantity": 'Int64',
+    "Add to Quantity": 'Int64',
+    "Old Marketplace Price": 'float64',
+    "My Store Reserve Quantity": 'Int64',
+    "Old My Store Price": 'float64',
+    "Photo URL": 'string',
+    "Old Qty": 'Int64',
+    "Base Price": 'float64',
+    "TCG Marketplace Price": 'float64',
+    "My Store Price": 'float64',
+    "Old Multiplier": 'float64',
+    "Multiplier": 'float64',
+    "Diff": 'float64'
+}
+
+# Columns of previous.csv the pricing logic actually reads
+PREVIOUS_LOOKUP_COLUMNS = ["TCGplayer Id", "Old Multiplier"]
+
+def prepare_previous(previous, columns=REQUIRED_PREVIOUS_COLUMNS):
+    """
+    Add missing columns to previous.csv and coerce them to their expected types
+    """
+    # Add missing columns with default values
+    for col, dtype in columns.items():
+        if col not in previous.columns:
+            if dtype == 'float64':
+                previous[col] = float('nan')
+            elif dtype == 'Int64':
+                previous[col] = pd.NA
+            else:
+                previous[col] = ''
+
+    # Convert column types
+    for col, dtype in columns.items():
+        try:
+            if dtype == 'Int64':
+                previous[col] = pd.to_numeric(previous[col], errors='coerce').astype('Int64')
+            elif dtype == 'float64':
+                previous[col] = pd.to_numeric(previous[col], errors='coerce')
+            elif dtype == 'string':
+                previous[col] = previous[col].astype(str)
+        except Exception:
+            previous[col] = float('nan')
+
+    return previous
+
+def prepare_current(current):
+    """
+    Rename, filter and normalize the rows of current.csv (or a chunk of it)
+    """
+    # Rename columns in current file
+    current = rename_current_columns(current)
+
+    # Filter rows, keeping a tally of the ones dropped for a missing market price
+    missing_market = missing_market_rows(current)
+    not_unopened, has_market = current_row_masks(current)
+    current = current[not_unopened & has_market]
+
+    # Ensure TCGplayer Id is numeric
+    current["TCGplayer Id"] = pd.to_numeric(current["TCGplayer Id"], errors='coerce').astype('Int64')
+
+    current.attrs[MISSING_MARKET_ATTR] = missing_market
+    return current
+
+def apply_pricing(current, previous):
+    """
+    Merge current rows with the previous multipliers and calculate new prices
+    """
+    print("Merging data...")
+    # Merge data
+    merged = pd.merge(
+        current,
+        previous[PREVIOUS_LOOKUP_COLUMNS],
+        on="TCGplayer Id",
+        how="left"
+    )
+
+    # Fill missing Old Multiplier with default value
+    merged["Old Multiplier"] = merged["Old Multiplier"].fillna(1.2)
+
+    print("Calculating base prices...")
+    # Calculate Base Price
+    def calculate_base_price(row):
+        market = row["TCG Market Price"]
+        low = row["TCG Low Price"]
+        if pd.notna(market) and pd.notna(low):
+            return round(min(market, low), 2)
+        elif pd.notna(low):
+            return round(low, 2)
+        elif pd.notna(market):
+            return round(market, 2)
+        else:
+            return 50000.00
+
+    merged["Base Price"] = merged.apply(calculate_base_price, axis=1)
+
+    print("Calculating multipliers...")
+    # Calculate Multiplier
+    def calculate_multiplier(row):
+        old_qty = row.get("Old Qty", 0)
+        new_qty = row.get("Total Quantity", 0)
+        old_mult = row.get("Old Multiplier", 1.2)
+
+        if old_qty == 0:
+            return 1.2
+        elif old_qty > 0 and new_qty == 0:
+            return 1.2
+        elif old_qty < new_qty:
+            return round(old_mult + 0.01, 2)
+        elif old_mult - 0.05 > 1:
+            return round(old_mult - 0.05, 2)
+        else:
+            return round(old_mult - 0.01, 2)
+
+    merged["Multiplier"] = merged.apply(calculate_multiplier, axis=1)
+
+    print("Calculating store prices...")
+    # Calculate My Store Price
+    def calculate_store_price(row):
+        market_price = row["TCG Market Price"]
+        base = row["Base Price"]
+        mult = row["Multiplier"]
+        qty = row["Total Quantity"]
+
+        raw_price = round(market_price if pd.notna(market_price) else base * mult, 2)
+        bump = 0.25
+        if qty >= 40:
+            bump = 0.05
+        elif qty >= 20:
+            bump = 0.15
+        return raw_price + max(0, bump - raw_price)
+
+    merged["My Store Price"] = merged.apply(calculate_store_price, axis=1)
+
+    print("Calculating differences...")
+    # Calculate Diff
+    merged["Old My Store Price"] = merged["Old My Store Price"].fillna(0.0)
+    merged["Diff"] = merged["My Store Price"] - merged["Old My Store Price"]
+
+    if MISSING_MARKET_ATTR in current.attrs:
+        merged.attrs[MISSING_MARKET_ATTR] = current.attrs[MISSING_MARKET_ATTR]
+    return merged
+
+def process_pricing_data_large(previous_file_path, current_file_path):
+    """
+    Process large pricing data files with memory optimization
+    """
+    try:
+        print("Starting large file processing...")
+        
+        # Process previous file
+        previous, error = process_csv_chunked(previous_file_path, "previous")
+        if error:
+            return None, f"Error processing previous file: {error}"
+        
+        # Process current file
+        current, error = process_csv_chunked(current_file_path, "current")
+        if error:
+            return None, f"Error processing current file: {error}"
+        
+        print(f"Previous file: {len(previous)} rows")
+        print(f"Current file: {len(current)} rows")
+        
+        previous = prepare_previous(previous)
+        current = prepare_current(current)
+        merged = apply_pricing(current, previous)
+
+        print("Processing complete!")
+        return merged, None
+        
+    except Exception as e:
+        return None, str(e)
+
+def load_previous_lookup(previous_file_path):
+    """
+    Load only the lookup columns of previous.csv
+    """
+    previous = pd.read_csv(
+        previous_file_path,
+        encoding='utf-8-sig',
+        usecols=lambda col: col in PREVIOUS_LOOKUP_COLUMNS
+    )
+    return prepare_previous(
+        previous,
+        {col: REQUIRED_PREVIOUS_COLUMNS[col] for col in PREVIOUS_LOOKUP_COLUMNS}
+    )
+
+def process_pricing_data_streaming(previous_file_path, current_file_path, output_path, chunk_size=10000, columns=None):
+    """
+    Low-memory variant of process_pricing_data_large. Only the previous
+    multipliers are kept in memory; current.csv is priced and written to
+    output_path one chunk at a time. Returns the summary and the per-group
+    breakdown partial instead of a DataFrame.
+    """
+    try:
+        print("Starting streaming processing...")
+
+        previous = load_previous_lookup(previous_file_path)
+        print(f"Previous file: {len(previous)} rows")
+
+        totals = new_summary_totals()
+        groups = None
+        write_header = True
+        for chunk in pd.read_csv(current_file_path, chunksize=chunk_size, encoding='utf-8-sig'):
+            merged = apply_pricing(prepare_current(chunk), previous)
+            write_pricing_csv(merged, output_path, columns=columns, header=write_header, append=not write_header)
+            write_header = False
+            update_summary_totals(totals, merged)
+            chunk_groups = group_partials(merged)
+            groups = chunk_groups if groups is None else combine_partials(groups, chunk_groups)
+            print(f"Processed chunk of {len(chunk)} rows")
+
+        print("Processing complete!")
+        return {'summary': finish_summary(totals), 'breakdown': groups}, None
+
+    except Exception as e:
+        return None, str(e)
+
+# --- SUMMARY HELPERS ---
+def build_summary(merged_df):
+    """Create summary statistics for a fully loaded result"""
+    return {
+        'total_items': len(merged_df),
+        'avg_market_price': round(merged_df['TCG Market Price'].mean(), 2),
+        'avg_store_price': round(merged_df['My Store Price'].mean(), 2),
+        'total_value': round(merged_df['My Store Price'].sum(), 2),
+        'price_changes': {
+            'increased': len(merged_df[merged_df['Diff'] > 0]),
+            'decreased': len(merged_df[merged_df['Diff'] < 0]),
+            'unchanged': len(merged_df[merged_df['Diff'] == 0])
+        },
+        'movers': find_movers(merged_df)
+    }
+
+def new_summary_totals():
+    """Running totals used to build the summary chunk by chunk"""
+    return {
+        'total_items': 0,
+        'market_count': 0,
+        'market_sum': 0.0,
+        'store_count': 0,
+        'store_sum': 0.0,
+        'increased': 0,
+        'decreased': 0,
+        'unchanged': 0,
+        'movers': MoversTracker()
+    }
+
+def update_summary_totals(totals, merged_df):
+    """Fold one priced chunk into the running totals"""
+    totals['total_items'] += len(merged_df)
+    totals['market_count'] += int(merged_df['TCG Market Price'].count())
+    totals['market_sum'] += float(merged_df['TCG Market Price'].sum())
+    totals['store_count'] += int(merged_df['My Store Price'].count())
+    totals['store_sum'] += float(merged_df['My Store Price'].sum())
+    totals['increased'] += int((merged_df['Diff'] > 0).sum())
+    totals['decreased'] += int((merged_df['Diff'] < 0).sum())
+    totals['unchanged'] += int((merged_df['Diff'] == 0).sum())
+    totals['movers'].update(merged_df)
+
+def merge_summary_totals(totals, other):
+    """Fold the running totals of the following rows (e.g. the next shard) into totals"""
+    for key, value in other.items():
+        if key == 'movers':
+            totals['movers'].merge(value)
+        else:
+            totals[key] += value
+    return totals
+
+def summary_totals_to_json(totals):
+    """JSON-serializable form of running totals, e.g. to pass a shard's totals on"""
+    data = {key: value for key, value in totals.items() if key != 'movers'}
+    data['movers'] = totals['movers'].state()
+    return data
+
+def summary_totals_from_json(data):
+    """Rebuild running totals written by summary_totals_to_json"""
+    totals = dict(data)
+    totals['movers'] = MoversTracker.from_state(data['movers'])
+    return totals
+
+def finish_summary(totals):
+    """Turn running totals into the same shape as build_summary"""
+    def mean(total, count):
+        return total / count if count else float('nan')
+
+    return {
+        'total_items': totals['total_items'],
+        'avg_market_price': round(mean(totals['market_sum'], totals['market_count']), 2),
+        'avg_store_price': round(mean(totals['store_sum'], totals['store_count']), 2),
+        'total_value': round(totals['store_sum'], 2),
+        'price_changes': {
+            'increased': totals['increased'],
+            'decreased': totals['decreased'],
+            'unchanged': totals['unchanged']
+        },
+        'movers': totals['movers'].result()
+    }
@@ -0,0 +1,56 @@
+"""
+Rules and numeric helpers shared by every pricing engine.
+
+Holds the pricing constants, the renaming and row filtering applied to
+current.csv before pricing, and the float/rounding helpers the engines,
+the CSV writer, the breakdown and the movers all rely on. It imports none of
+them, so any of them can import it.
+"""
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MULTIPLIER = 1.2
+FALLBACK_BASE_PRICE = 50000.00
+
+# Uploaded price columns kept as the old prices; pricing writes new ones
+CURRENT_RENAMES = {
+    "My Store Price": "Old My Store Price",
+    "TCG Marketplace Price": "Old Marketplace Price"
+}
+
+def rename_current_columns(current):
+    """Rename the uploaded prices of current.csv, adding the old ones as NaN if missing"""
+    for col, old_col in CURRENT_RENAMES.items():
+        if col in current.columns:
+            current = current.rename(columns={col: old_col})
+        else:
+            current[old_col] = float('nan')
+    return current
+
+def current_row_masks(current):
+    """
+    Boolean masks of the renamed current rows: not Unopened (a missing
+    Condition counts as not Unopened) and with a TCG Market Price.
+    Pricing keeps the rows where both are set.
+    """
+    not_unopened = (current["Condition"] != "Unopened").fillna(True).to_numpy(dtype=bool)
+    has_market = current["TCG Market Price"].notna().to_numpy(dtype=bool)
+    return not_unopened, has_market
+
+def to_float_array(series):
+    """Numeric view of a column as a float64 NumPy array with NaN for nulls"""
+    if not pd.api.types.is_numeric_dtype(series.dtype):
+        series = pd.to_numeric(series, errors='coerce')
+    return series.to_numpy(dtype='float64', na_value=np.nan)
+
+def round2(values):
+    """
+    Vectorized round(x, 2) that matches Python's round() exactly.
+    np.round scales by 100 first and can disagree on near-ties, so the distinct
+    values are rounded with Python and mapped back.
+    """
+    values = np.asarray(values, dtype='float64')
+    uniques, inverse = np.unique(values, return_inverse=True)
+    rounded = np.array([round(v, 2) for v in uniques.tolist()], dtype='float64')
+    return rounded[inverse].reshape(values.shape)
@@ -0,0 +1,249 @@
+"""
+Pricing worker for distributed jobs.
+
+Leases tasks from the broker: a job's split task cuts its uploaded current.csv
+into shards, each shard is priced with the same pipeline as the streaming path
+(its output CSV, summary totals and breakdown partial go to the job directory),
+and once every shard is done the collect task merges them into the job's
+output. Run any number of workers on any host that mounts the broker directory:
+
+    python worker.py /shared/pricing-broker
+
+and start the web app with BROKER_DIR=/shared/pricing-broker.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from breakdown import combine_partials, group_partials, partial_from_json, partial_to_json
+from broker import SQLiteBroker
+from csv_export import write_pricing_csv
+from pricing import (
+    apply_pricing,
+    finish_summary,
+    load_previous_lookup,
+    merge_summary_totals,
+    new_summary_totals,
+    prepare_current,
+    summary_totals_from_json,
+    summary_totals_to_json,
+    update_summary_totals
+)
+
+DEFAULT_LEASE_SECONDS = 60
+DEFAULT_POLL_SECONDS = 2
+
+def keep_lease(broker, shard, worker_id, lease_seconds, stop):
+    """Extend the lease every third of its length until stop is set"""
+    while not stop.wait(lease_seconds / 3):
+        try:
+            if not broker.heartbeat(shard['shard_id'], worker_id, lease_seconds):
+                print(f"Lost the lease on shard {shard['shard_id']}")
+                return
+        except Exception as e:
+            print(f"Heartbeat for shard {shard['shard_id']} failed: {e}")
+
+def temp_suffix():
+    # Unique across hosts, so two workers holding the same shard never share a file
+    return f".{uuid.uuid4().hex}.tmp"
+
+def split_job(broker, shard):
+    """
+    Split a job's current.csv into shards of shard_rows rows.
+    Returns the split result, with one payload per shard to queue.
+    """
+    payload = shard['payload']
+    job_dir = os.path.dirname(payload['current_path'])
+    current_path = broker.path(payload['current_path'])
+    suffix = temp_suffix()
+
+    def write_shard(index, frame):
+        shard_path = os.path.join(job_dir, f'shard_{index:05d}.csv')
+        frame.to_csv(broker.path(shard_path) + suffix, index=False)
+        os.replace(broker.path(shard_path) + suffix, broker.path(shard_path))
+        return {
+            'previous_path': payload['previous_path'],
+            'current_path': shard_path,
+            'output_path': os.path.join(job_dir, f'shard_{index:05d}.out.csv'),
+            'partials_path': os.path.join(job_dir, f'shard_{index:05d}.partials.json'),
+            'columns': payload['columns']
+        }
+
+    # Cells stay as text so every shard holds exactly what was uploaded
+    payloads = []
+    for index, chunk in enumerate(pd.read_csv(current_path, chunksize=payload['shard_rows'], dtype=str, keep_default_na=False, encoding='utf-8-sig')):
+        payloads.append(write_shard(index, chunk))
+    if not payloads:
+        payloads.append(write_shard(0, pd.read_csv(current_path, nrows=0, encoding='utf-8-sig')))
+
+    return {'payloads': payloads}
+
+def process_shard(broker, shard, previous_cache):
+    """
+    Price one shard and write its outputs.
+    Returns the shard result to report to the broker.
+    """
+    payload = shard['payload']
+
+    # Shards of the same job share the previous lookup table
+    if previous_cache.get('job_id') != shard['job_id']:
+        previous_cache.clear()
+        previous_cache['previous'] = load_previous_lookup(broker.path(payload['previous_path']))
+        previous_cache['job_id'] = shard['job_id']
+    previous = previous_cache['previous']
+
+    current = pd.read_csv(broker.path(payload['current_path']), encoding='utf-8-sig')
+    merged = apply_pricing(prepare_current(current), previous)
+
+    totals = new_summary_totals()
+    update_summary_totals(totals, merged)
+    partials = {
+        'totals': summary_totals_to_json(totals),
+        'breakdown': partial_to_json(group_partials(merged))
+    }
+
+    # Write under a private name first so a retried shard never sees half a file
+    output_path = broker.path(payload['output_path'])
+    partials_path = broker.path(payload['partials_path'])
+    suffix = temp_suffix()
+    write_pricing_csv(merged, output_path + suffix, columns=payload['columns'])
+    with open(partials_path + suffix, 'w') as f:
+        json.dump(partials, f)
+    os.replace(output_path + suffix, output_path)
+    os.replace(partials_path + suffix, partials_path)
+
+    return {
+        'output_path': payload['output_path'],
+        'partials_path': payload['partials_path'],
+        'rows': len(merged)
+    }
+
+def collect_job(broker, shard):
+    """
+    Concatenate the shard outputs of a fully processed job into its output
+    file and merge their summary totals and breakdown partials in shard order.
+    Returns the job result reported to the broker.
+    """
+    payload = shard['payload']
+    output_path = broker.path(payload['output_path'])
+    breakdown_path = broker.path(payload['breakdown_path'])
+    suffix = temp_suffix()
+
+    totals = None
+    groups = None
+    try:
+        with open(output_path + suffix, 'wb') as output:
+            for index, result in enumerate(broker.shard_results(shard['job_id'])):
+                with open(broker.path(result['output_path']), 'rb') as shard_output:
+                    # Every shard output starts with the header, keep only the first
+                    if index > 0:
+                        shard_output.readline()
+                    shutil.copyfileobj(shard_output, output, 1024 * 1024)
+
+                with open(broker.path(result['partials_path'])) as f:
+                    partials = json.load(f)
+                shard_totals = summary_totals_from_json(partials['totals'])
+                shard_groups = partial_from_json(partials['breakdown'])
+                totals = shard_totals if totals is None else merge_summary_totals(totals, shard_totals)
+                groups = shard_groups if groups is None else combine_partials(groups, shard_groups)
+
+        with open(breakdown_path + suffix, 'w') as f:
+            json.dump(partial_to_json(groups), f)
+        os.replace(output_path + suffix, output_path)
+        os.replace(breakdown_path + suffix, breakdown_path)
+    except Exception:
+        # Results live outside the job directory, so don't leave partial files behind
+        for path in (output_path + suffix, breakdown_path + suffix):
+            if os.path.exists(path):
+                os.unlink(path)
+        raise
+
+    return {
+        'summary': finish_summary(totals),
+        'filename': payload['filename'],
+        'file_size_mb': round(os.path.getsize(output_path) / (1024 * 1024), 2)
+    }
+
+def run_worker(broker, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS, poll_seconds=DEFAULT_POLL_SECONDS, exit_when_idle=False):
+    """
+    Lease and run split, shard and collect tasks until interrupted, or with
+    exit_when_idle until nothing is runnable. Returns the number of tasks completed.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    previous_cache = {}
+    completed = 0
+
+    while True:
+        shard = broker.lease_shard(worker_id, lease_seconds)
+        if shard is None:
+            if exit_when_idle:
+                return completed
+            time.sleep(poll_seconds)
+            continue
+
+        print(f"Worker {worker_id} leased shard {shard['shard_id']} (attempt {shard['attempts']})")
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=keep_lease,
+            args=(broker, shard, worker_id, lease_seconds, stop),
+            daemon=True
+        )
+        heartbeat.start()
+
+        result, error = None, None
+        try:
+            if shard['kind'] == 'split':
+                result = split_job(broker, shard)
+            elif shard['kind'] == 'collect':
+                result = collect_job(broker, shard)
+            else:
+                result = process_shard(broker, shard, previous_cache)
+        except Exception as e:
+            error = str(e)
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        if error:
+            print(f"Shard {shard['shard_id']} failed: {error}")
+            broker.fail_shard(shard['shard_id'], worker_id, error)
+        elif broker.complete_shard(shard['shard_id'], worker_id, result):
+            completed += 1
+            print(f"Completed {shard['kind']} {shard['shard_id']}")
+        else:
+            # The lease expired and the shard went to another worker
+            print(f"Discarded shard {shard['shard_id']}: lease no longer held")
+
+def main():
+    parser = argparse.ArgumentParser(description="Split, price and collect shards of distributed jobs")
+    parser.add_argument('broker_dir', help="shared broker directory (BROKER_DIR of the web app)")
+    parser.add_argument('--worker-id', help="name reported to the broker (default: host-pid)")
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS, help="lease length in seconds")
+    parser.add_argument('--poll', type=float, default=DEFAULT_POLL_SECONDS, help="seconds to wait when idle")
+    parser.add_argument('--max-attempts', type=int, default=3, help="attempts per shard before the job fails")
+    parser.add_argument('--once', action='store_true', help="exit when there is no work left")
+    args = parser.parse_args()
+
+    broker = SQLiteBroker(args.broker_dir, max_attempts=args.max_attempts)
+    try:
+        completed = run_worker(
+            broker,
+            worker_id=args.worker_id,
+            lease_seconds=args.lease,
+            poll_seconds=args.poll,
+            exit_when_idle=args.once
+        )
+        print(f"Worker finished after {completed} tasks")
+    except KeyboardInterrupt:
+        print("Worker stopped")
+
+if __name__ == '__main__':
+    main()